@@ -1,24 +1,150 @@
-from openai import OpenAI
-import os
-
-def _get_openai_key():
-    try:
-        from streamlit.runtime.secrets import secrets as st_secrets
-        k = st_secrets.get("OPENAI_API_KEY")
-        if k: return k
-    except Exception:
-        pass
-    return os.getenv("OPENAI_API_KEY")
-
-_client = OpenAI(api_key=_get_openai_key())
+import threading
+import pandas as pd
+import llm_client, tracing
+from ingest import BM25Index, CHARS_PER_TOKEN, chunk_blocks, tokenize
 
 SYSTEM = ("You are QRT Advisor Chat, a concise senior consultant for renewable projects. "
           "Answer with short, specific, actionable guidance. If data is unknown, say so and propose how to find it.")
+SESSION_SYSTEM = SYSTEM + (" Each question comes with excerpts of the project's strategic analysis; "
+                           "rely on them and on the conversation so far.")
+
+CONTEXT_TOKENS = 1500       # extractos del análisis por pregunta
+HISTORY_TOKENS = 1500       # conversación previa que se reenvía
+SECTION_CHARS = 900         # las secciones largas se trocean para recuperarlas por partes
 
 def ask_advisor(user_question: str, context_blob: str) -> str:
     msg = [
         {"role":"system","content": SYSTEM},
         {"role":"user","content": f"Context:\n{context_blob}\n\nQuestion:\n{user_question}"}
     ]
-    r = _client.chat.completions.create(model="gpt-4o-mini", messages=msg, temperature=0.2)
-    return r.choices[0].message.content
+    with tracing.span("advisor.ask") as sp:
+        r = llm_client.chat(msg, temperature=0.2)
+        sp["tokens"] = getattr(getattr(r, "usage", None), "total_tokens", None)
+        return r.choices[0].message.content
+
+# ---------------------------------
+# Sesión con memoria y recuperación sobre el análisis
+# ---------------------------------
+def _tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def _fmt_num(x) -> str:
+    return "?" if pd.isna(x) else f"{x:g}" if isinstance(x, float) else str(x)
+
+def context_docs(res: dict) -> list:
+    """Contexto compacto del análisis: [(título, texto)], un documento por unidad recuperable."""
+    docs = []
+    def add(title, text):
+        text = str(text or "").strip()
+        if text:
+            for part in chunk_blocks([text], size=SECTION_CHARS, overlap=0):
+                docs.append((title, part))
+
+    add("Executive summary", res.get("executive_summary"))
+    pestel = res.get("pestel")
+    if isinstance(pestel, pd.DataFrame) and not pestel.empty:
+        for row in pestel.to_dict("records"):
+            pts = row.get("points")
+            pts = "; ".join(map(str, pts)) if isinstance(pts, list) else str(pts or "")
+            add(f"PESTEL - {row.get('factor', '')}", f"{pts}. Assessment: {row.get('assessment') or ''}")
+    for q, items in (res.get("swot") or {}).items():
+        add(f"SWOT - {q}", "; ".join(map(str, items or [])))
+    risks = res.get("risks")
+    if isinstance(risks, pd.DataFrame) and not risks.empty:
+        for row in risks.to_dict("records"):
+            add(f"Risk - {row.get('category', '')} ({row.get('priority') or 'n/a'}, score {_fmt_num(row.get('score'))})",
+                f"{row.get('risk', '')} | probability {_fmt_num(row.get('probability'))}, "
+                f"impact {_fmt_num(row.get('impact'))} | mitigation: {row.get('mitigation') or '-'}")
+    add("Legal & fiscal", res.get("legal_fiscal"))
+    add("Logistics & infrastructure", res.get("logistics"))
+    add("Recommendations", "; ".join(map(str, res.get("recommendations") or [])))
+    return docs
+
+def project_digest(res: dict, params: dict = None) -> str:
+    """Cabecera fija de cada pregunta: proyecto y recuento de riesgos por prioridad."""
+    parts = []
+    if params:
+        parts.append(", ".join(f"{k}: {params[k]}" for k in ("country", "technology", "capacity_mw",
+                                                             "client", "offtaker", "horizon") if params.get(k)))
+    risks = res.get("risks")
+    if isinstance(risks, pd.DataFrame) and "priority" in risks.columns and not risks.empty:
+        counts = risks["priority"].value_counts()
+        parts.append("risks: " + ", ".join(f"{p} x{counts[p]}" for p in ["P1", "P2", "P3"] if p in counts))
+    return "Project - " + " | ".join(parts) if parts else ""
+
+class AdvisorSession:
+    """Chat del asesor sobre un análisis: contexto indexado una vez, memoria con presupuesto de tokens."""
+
+    def __init__(self, res: dict, params: dict = None, context_tokens: int = CONTEXT_TOKENS,
+                 history_tokens: int = HISTORY_TOKENS):
+        self.docs = context_docs(res)
+        self.index = BM25Index([f"{t}\n{x}" for t, x in self.docs])
+        self.digest = project_digest(res, params)
+        self.context_tokens, self.history_tokens = context_tokens, history_tokens
+        self.history = []           # [{"role", "content"}] sin el contexto (no se reenvía)
+        self.last_prompt_tokens = 0
+        self._lock = threading.Lock()
+
+    def retrieve(self, question: str) -> str:
+        """Extractos más relevantes para la pregunta (y la anterior, para preguntas de seguimiento)."""
+        prev = next((m["content"] for m in reversed(self.history) if m["role"] == "user"), "")
+        query = dict.fromkeys(tokenize(prev), 0.5) | dict.fromkeys(tokenize(question), 1.0)
+        scores = self.index.scores(query)
+        if not any(scores):
+            # sin coincidencias: resumen ejecutivo y riesgos P1 primero
+            scores = [2 * t.startswith("Executive") + ("(P1" in t) for t, _ in self.docs]
+        ranked = sorted(range(len(self.docs)), key=lambda k: (-scores[k], k))
+        budget, picked = self.context_tokens, []
+        for k in ranked:
+            if scores[k] <= 0:
+                break
+            cost = _tokens(self.docs[k][0] + self.docs[k][1])
+            if cost <= budget:
+                picked.append(k); budget -= cost
+        return "\n".join(f"[{self.docs[k][0]}] {self.docs[k][1]}" for k in sorted(picked))
+
+    def _trimmed_history(self) -> list:
+        kept, used = [], 0
+        for m in reversed(self.history):
+            used += _tokens(m["content"])
+            if used > self.history_tokens:
+                break
+            kept.append(m)
+        kept.reverse()
+        # nunca empezar con una respuesta huérfana
+        return kept[1:] if kept and kept[0]["role"] == "assistant" else kept
+
+    def messages(self, question: str) -> list:
+        ctx = "\n".join(x for x in (self.digest, self.retrieve(question)) if x)
+        msgs = [{"role": "system", "content": SESSION_SYSTEM}] + self._trimmed_history() + \
+               [{"role": "user", "content": f"Analysis excerpts:\n{ctx}\n\nQuestion:\n{question}"}]
+        self.last_prompt_tokens = sum(_tokens(m["content"]) for m in msgs)
+        return msgs
+
+    def _remember(self, question: str, answer: str):
+        with self._lock:
+            self.history += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+
+    def ask(self, question: str) -> str:
+        with tracing.span("advisor.ask", history=len(self.history)) as sp:
+            r = llm_client.chat(self.messages(question), temperature=0.2)
+            sp["tokens"] = getattr(getattr(r, "usage", None), "total_tokens", None)
+            sp["prompt_tokens_est"] = self.last_prompt_tokens
+        answer = r.choices[0].message.content
+        self._remember(question, answer)
+        return answer
+
+    def ask_stream(self, question: str):
+        """Generador de fragmentos de la respuesta; la guarda en el historial al terminar."""
+        parts = []
+        with tracing.span("advisor.ask", history=len(self.history), stream=True) as sp:
+            msgs = self.messages(question)
+            sp["prompt_tokens_est"] = self.last_prompt_tokens
+            for piece in llm_client.chat_stream(msgs, temperature=0.2):
+                parts.append(piece)
+                yield piece
+        self._remember(question, "".join(parts))
+
+    def reset(self):
+        with self._lock:
+            self.history = []
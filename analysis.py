@@ -1,10 +1,12 @@
 # analysis.py — QRT Strategic Analyst (Template-based, safe)
 
-import os, json
+import json, re, time, logging
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from typing import Dict, Any
+from typing import Dict, Any, Union
 from string import Template
-from openai import OpenAI
+import llm_cache, llm_client, risk_matrix, tracing
+from ingest import select_chunks
 
 # ----------------------------
 # PROMPTS (usa $placeholders)
@@ -51,34 +53,149 @@ Requirements:
 - End with 6–10 crisp recommendations that are actionable this month.
 """)
 
+# Modo por secciones: mismo contexto, un esquema parcial por llamada
+SECTION_PROMPT = Template("""Build the following part of a strategic analysis for the project and return ONLY a JSON object with this schema:
+$schema
+
+Context:
+- Country: $country
+- Technology: $technology
+- Capacity (MW): $capacity_mw
+- Client: $client
+- Offtaker: $offtaker
+- Horizon: $horizon
+
+Additional notes from user:
+$user_context
+
+Attachments (raw excerpts, if any):
+$attachments
+
+Requirements:
+- Be specific to the country/technology whenever possible.
+$requirements
+""")
+
+SECTION_SPECS = {
+    "summary": ("""{"executive_summary": "string", "recommendations": ["..."]}""",
+                "- End with 6–10 crisp recommendations that are actionable this month."),
+    "pestel": ("""{"pestel": [{"factor":"Political","points":["..."],"assessment":"..."}]}""",
+               "- For PESTEL, give 3–5 bullet points per factor + a brief assessment."),
+    "swot": ("""{"swot": {"strengths": ["..."], "weaknesses": ["..."], "opportunities": ["..."], "threats": ["..."]}}""",
+             "- For SWOT, keep 4–6 bullets per quadrant."),
+    "risks": ("""{"risks": [{"category":"Regulatory","risk":"...","probability":1-5,"impact":1-5,"mitigation":"..."}]}""",
+              "- For Risks, include at least 8–12 items spanning: Regulatory, Technical, Financial, Fiscal, Environmental, Logistic, Social/Stakeholder.\n"
+              "- Keep probability/impact on a 1–5 scale."),
+    "legal_fiscal": ("""{"legal_fiscal": "string (permits, licensing, VAT/Duty/Corporate tax, RE incentives, PPA norms)"}""",
+                     "- In legal_fiscal, summarize permits/licensing + typical VAT/Duty + common RE incentives (if applicable)."),
+    "logistics": ("""{"logistics": "string (ports, customs, road constraints, storage, weather windows)"}""",
+                  "- In logistics, cover port clearance days, likely HS-code pitfalls, route surveys, seasonal constraints."),
+}
+
 # ---------------------------------
-# OpenAI client (secrets o env var)
+# Cliente OpenAI compartido (ver llm_client)
 # ---------------------------------
-def _get_openai_key():
-    """Busca la API key primero en Streamlit Secrets y luego en variables de entorno."""
-    try:
-        from streamlit.runtime.secrets import secrets as st_secrets  # en Streamlit Cloud
-        key = st_secrets.get("OPENAI_API_KEY")
-        if key:
-            return key
-    except Exception:
-        pass
-    return os.getenv("OPENAI_API_KEY")
-
-client = OpenAI(api_key=_get_openai_key())
-
-def call_llm(messages: list, temperature: float = 0.2) -> str:
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        temperature=temperature,
-    )
-    return resp.choices[0].message.content
+MODEL = llm_client.MODEL
+usage = llm_client.usage
+
+def call_llm(messages: list, temperature: float = 0.2, use_cache: bool = False, timeout: float = None,
+             max_retries: int = None, read_cache: bool = True, write_cache: bool = True) -> str:
+    # Caché por hash de prompt + modelo + temperatura (ver llm_cache). Quien valida la
+    # respuesta antes de darla por buena pasa write_cache=False y guarda con cache_answer();
+    # un reintento pasa read_cache=False para no recibir otra vez la respuesta cacheada.
+    with tracing.span("llm.call", model=MODEL, cache_hit=False) as sp:
+        key = llm_cache.cache_key(messages, MODEL, temperature) if use_cache else None
+        if key and read_cache:
+            hit = llm_cache.get(key)
+            if hit is not None:
+                sp["cache_hit"] = True
+                return hit
+        resp = llm_client.chat(messages, temperature=temperature, model=MODEL, timeout=timeout,
+                               max_retries=max_retries)
+        sp["tokens"] = getattr(getattr(resp, "usage", None), "total_tokens", None)
+        content = resp.choices[0].message.content
+        if key and write_cache and content:
+            llm_cache.put(key, MODEL, content)
+        return content
+
+def cache_answer(messages: list, content: str, temperature: float = 0.2):
+    """Guarda en la caché una respuesta ya validada (ver call_llm(write_cache=False))."""
+    if content:
+        llm_cache.put(llm_cache.cache_key(messages, MODEL, temperature), MODEL, content)
+
+def stream_llm(messages: list, temperature: float = 0.2):
+    """Devuelve un generador con los fragmentos de texto del stream de chat-completions."""
+    return llm_client.chat_stream(messages, temperature=temperature, model=MODEL)
+
+# ---------------------------------
+# Parser incremental del JSON en streaming
+# ---------------------------------
+class SectionStreamParser:
+    """Detecta claves de primer nivel del objeto JSON a medida que llega el texto.
+
+    `feed(text)` devuelve la lista de (clave, valor) cuyas secciones se han
+    completado con ese fragmento. Ignora texto previo al primer '{' (p.ej. ```json).
+    """
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_str = False
+        self.esc = False
+        self.key = None          # última clave de primer nivel leída
+        self.str_start = None
+        self.val_start = None
+        self.done = False
+
+    def feed(self, text: str):
+        self.buf += text
+        out = []
+        while self.pos < len(self.buf) and not self.done:
+            ch = self.buf[self.pos]
+            if self.in_str:
+                if self.esc: self.esc = False
+                elif ch == "\\": self.esc = True
+                elif ch == '"':
+                    self.in_str = False
+                    if self.depth == 1 and self.val_start is None:
+                        self.key = json.loads(self.buf[self.str_start:self.pos + 1])
+            elif ch == '"':
+                self.in_str = True
+                if self.depth == 1 and self.val_start is None:
+                    self.str_start = self.pos
+            elif ch in "{[":
+                self.depth += 1
+            elif ch == ":" and self.depth == 1 and self.key is not None:
+                self.val_start = self.pos + 1
+            elif (ch == "," and self.depth == 1) or (ch == "}" and self.depth == 1):
+                if self.key is not None and self.val_start is not None:
+                    try:
+                        out.append((self.key, json.loads(self.buf[self.val_start:self.pos])))
+                    except Exception:
+                        pass
+                self.key = None; self.val_start = None
+                if ch == "}":
+                    self.depth = 0; self.done = True
+            elif ch in "}]":
+                self.depth -= 1
+            self.pos += 1
+        return out
 
 # ---------------------------------
 # Función principal de análisis
 # ---------------------------------
-def run_strategic_analysis(
+EMPTY_SWOT = {"strengths": [], "weaknesses": [], "opportunities": [], "threats": []}
+SECTIONS = ["executive_summary", "pestel", "swot", "risks", "legal_fiscal", "logistics", "recommendations"]
+
+def prepare_attachments(attachments: Union[Dict[str, Any], str], country: str, technology: str,
+                        user_context: str = "") -> str:
+    """Anexos: trozos más relevantes (BM25 local) dentro del presupuesto de tokens;
+    si ya vienen preparados como texto, se usan tal cual."""
+    if isinstance(attachments, str):
+        return attachments
+    return select_chunks(attachments, f"{country} {technology} {user_context or ''}")
+
+def build_messages(
     country: str,
     technology: str,
     capacity_mw: float,
@@ -86,22 +203,16 @@ def run_strategic_analysis(
     offtaker: str,
     horizon: str,
     user_context: str = "",
-    attachments: Dict[str, Any] = None
-) -> Dict[str, Any]:
+    attachments: Union[Dict[str, Any], str] = None,
+    template: Template = USER_PROMPT,
+    **extra
+) -> list:
 
-    # Preparar anexos como texto simple
-    attachments_txt = ""
-    if attachments:
-        for name, content in attachments.items():
-            if isinstance(content, (bytes, bytearray)):
-                try:
-                    content = content.decode("utf-8", errors="ignore")
-                except Exception:
-                    content = f"[Binary file: {name}, omitted]"
-            attachments_txt += f"\n\n### Attachment: {name}\n{content[:5000]}"
+    attachments_txt = prepare_attachments(attachments, country, technology, user_context)
 
     # Construir prompt con Template (evita conflictos con { })
-    user_msg = USER_PROMPT.safe_substitute(
+    user_msg = template.safe_substitute(
+        extra,
         country=country,
         technology=technology,
         capacity_mw=capacity_mw,
@@ -111,50 +222,344 @@ def run_strategic_analysis(
         user_context=user_context or "",
         attachments=attachments_txt or ""
     )
-
-    # Llamada al modelo
-    content = call_llm([
+    return [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user_msg}
-    ])
-
-    # Parseo seguro del JSON devuelto
-    try:
-        data = json.loads(content)
-    except Exception:
-        data = {
-            "executive_summary": content,
-            "pestel": [],
-            "swot": {"strengths": [], "weaknesses": [], "opportunities": [], "threats": []},
-            "risks": [],
-            "legal_fiscal": content,
-            "logistics": content,
-            "recommendations": []
-        }
-
-    # Normalizar tablas
-    pestel_df = pd.DataFrame(data.get("pestel", []))
-    risks_df = pd.DataFrame(data.get("risks", []))
-
-    # Auto-priorizar riesgos si hay prob/impact
-    if "probability" in risks_df.columns and "impact" in risks_df.columns:
-        try:
-            risks_df["score"] = risks_df["probability"].astype(float) * risks_df["impact"].astype(float)
-            def prio(s):
-                s = float(s)
-                if s >= 15: return "P1"
-                if s >= 7:  return "P2"
-                return "P3"
-            risks_df["priority"] = risks_df["score"].apply(prio)
-        except Exception:
-            pass
+    ]
+
+# ---------------------------------
+# Parseo robusto: JSON extraído, reparado y validado por sección
+# ---------------------------------
+# claves de primer nivel que produce cada llamada de SECTION_SPECS
+SECTION_KEYS = {"summary": ["executive_summary", "recommendations"], "pestel": ["pestel"], "swot": ["swot"],
+                "risks": ["risks"], "legal_fiscal": ["legal_fiscal"], "logistics": ["logistics"]}
+SWOT_QUADRANTS = list(EMPTY_SWOT)
+
+_FENCE = re.compile(r"```(?:json)?", re.I)
+# cadenas JSON (se dejan intactas) | coma colgante | fracción sin comillas (3/5)
+_REPAIRABLE = re.compile(r'"(?:[^"\\]|\\.)*"|,(?=\s*[}\]])|(?<=:)(\s*)(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)')
+
+def repair_json(text: str) -> str:
+    """Corrige fallos recuperables del LLM: comas colgantes y fracciones sin comillas."""
+    def fix(m):
+        if m.group(0).startswith('"'):
+            return m.group(0)
+        if m.group(0) == ",":
+            return ""
+        return f'{m.group(1)}"{m.group(2)}/{m.group(3)}"'
+    return _REPAIRABLE.sub(fix, text)
+
+def _objects(text: str) -> list:
+    """Objetos {...} de primer nivel balanceados (respetando cadenas), del más largo al más corto."""
+    spans, depth, start, in_str, esc = [], 0, None, False, False
+    for i, ch in enumerate(text):
+        if in_str:
+            if esc: esc = False
+            elif ch == "\\": esc = True
+            elif ch == '"': in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                spans.append(text[start:i + 1])
+    return sorted(spans, key=len, reverse=True)
+
+def extract_json(content: str) -> Dict[str, Any]:
+    """Mayor objeto JSON válido del texto (sin vallas ```json, reparado si hace falta).
+
+    Si ningún objeto cierra (salida truncada), recupera las secciones ya completas con
+    SectionStreamParser. Devuelve {} si no hay nada aprovechable.
+    """
+    text = _FENCE.sub("", content or "")
+    for cand in _objects(text):
+        for attempt in (cand, repair_json(cand)):
+            try:
+                data = json.loads(attempt)
+            except ValueError:
+                continue
+            if isinstance(data, dict):
+                return data
+    parser = SectionStreamParser()
+    return dict(parser.feed(repair_json(text)))
+
+def _levels(values: list) -> list:
+    """Probabilidad/impacto a enteros 1..SCALE con risk_matrix.to_level; None si no se interpreta."""
+    lv = risk_matrix.to_level(pd.Series(values, dtype=object)).round().clip(1, risk_matrix.SCALE)
+    return [None if pd.isna(x) else int(x) for x in lv]
+
+def _str_list(v) -> list:
+    if isinstance(v, str):
+        v = [v]
+    return [str(x).strip() for x in v if str(x).strip()] if isinstance(v, list) else []
+
+def _valid_text(v):
+    return v.strip() if isinstance(v, str) and v.strip() else None
+
+def _valid_list(v):
+    return _str_list(v) or None
 
+def _valid_pestel(v):
+    rows = []
+    for r in v if isinstance(v, list) else []:
+        if isinstance(r, dict) and _valid_text(r.get("factor")):
+            rows.append({"factor": r["factor"].strip(), "points": _str_list(r.get("points")),
+                         "assessment": str(r.get("assessment") or "")})
+    return rows or None
+
+def _valid_swot(v):
+    if not isinstance(v, dict):
+        return None
+    swot = {q: _str_list(v.get(q)) for q in SWOT_QUADRANTS}
+    return swot if any(swot.values()) else None
+
+def _valid_risks(v):
+    rows = [r for r in (v if isinstance(v, list) else []) if isinstance(r, dict) and _valid_text(r.get("risk"))]
+    probs, impacts = _levels([r.get("probability") for r in rows]), _levels([r.get("impact") for r in rows])
+    rows = [{**r, "probability": p, "impact": i} for r, p, i in zip(rows, probs, impacts)]
+    # sin ningún nivel interpretable la tabla no sirve para la matriz: se vuelve a pedir
+    return rows if any(r["probability"] and r["impact"] for r in rows) else None
+
+VALIDATORS = {"executive_summary": _valid_text, "pestel": _valid_pestel, "swot": _valid_swot,
+              "risks": _valid_risks, "legal_fiscal": _valid_text, "logistics": _valid_text,
+              "recommendations": _valid_list}
+
+def validate_sections(data: Dict[str, Any]) -> tuple:
+    """(secciones válidas ya saneadas, claves que faltan o no cumplen el esquema)."""
+    ok, missing = {}, []
+    for key in SECTIONS:
+        value = VALIDATORS[key](data.get(key)) if isinstance(data, dict) else None
+        if value is None:
+            missing.append(key)
+        else:
+            ok[key] = value
+    return ok, missing
+
+def parse_structured(content: str) -> tuple:
+    """Extrae, repara y valida la respuesta: (secciones válidas, secciones que faltan)."""
+    data, missing = validate_sections(extract_json(content))
+    if missing:
+        tracing.event("llm.parse_error", chars=len(content or ""), missing=",".join(missing))
+    return data, missing
+
+def parse_content(content: str) -> Dict[str, Any]:
+    # Solo las secciones válidas; si no se pudo aprovechar nada, el texto va una vez al resumen
+    data, missing = parse_structured(content)
+    if len(missing) == len(SECTIONS) and (content or "").strip():
+        data["executive_summary"] = content
+    return data
+
+def risks_frame(risks: list) -> pd.DataFrame:
+    # auto-priorizar riesgos si hay prob/impact (vectorizado, ver risk_matrix)
+    return risk_matrix.score_risks(pd.DataFrame(risks))
+
+def normalize_section(key: str, value):
+    """Convierte una sección del JSON al tipo que usa la app (DataFrames para tablas)."""
+    if key == "pestel":
+        return pd.DataFrame(value or [])
+    if key == "risks":
+        return risks_frame(value or [])
+    if key == "swot":
+        return value if value is not None else dict(EMPTY_SWOT)
+    if key == "recommendations":
+        return value or []
+    return value if value is not None else ""
+
+def normalize_result(data: Dict[str, Any]) -> Dict[str, Any]:
     return {
         "executive_summary": data.get("executive_summary", ""),
-        "pestel": pestel_df,
-        "swot": data.get("swot", {"strengths": [], "weaknesses": [], "opportunities": [], "threats": []}),
-        "risks": risks_df,
+        "pestel": normalize_section("pestel", data.get("pestel", [])),
+        "swot": data.get("swot", dict(EMPTY_SWOT)),
+        "risks": normalize_section("risks", data.get("risks", [])),
         "legal_fiscal": data.get("legal_fiscal", ""),
         "logistics": data.get("logistics", ""),
         "recommendations": data.get("recommendations", [])
     }
+
+def run_strategic_analysis(
+    country: str,
+    technology: str,
+    capacity_mw: float,
+    client: str,
+    offtaker: str,
+    horizon: str,
+    user_context: str = "",
+    attachments: Dict[str, Any] = None,
+    use_cache: bool = True,
+    parallel: bool = False
+) -> Dict[str, Any]:
+    if parallel:
+        return run_sectioned_analysis(country, technology, capacity_mw, client, offtaker, horizon,
+                                      user_context, attachments, use_cache=use_cache)
+    # texto de anexos una sola vez: la reparación por secciones lo reutiliza
+    attachments = prepare_attachments(attachments, country, technology, user_context)
+    messages = build_messages(country, technology, capacity_mw, client, offtaker, horizon,
+                              user_context, attachments)
+    # Llamada al modelo; a la caché solo va una respuesta completa y válida
+    content = call_llm(messages, use_cache=use_cache, write_cache=False)
+    data, missing = parse_structured(content)
+    if missing:
+        data.update(request_sections(missing, country, technology, capacity_mw, client, offtaker, horizon,
+                                     user_context, attachments, use_cache=use_cache))
+    if use_cache:
+        _cache_result(messages, content, data, missing)
+    return normalize_result(_with_raw_fallback(data, content))
+
+# ---------------------------------
+# Modo paralelo por secciones
+# ---------------------------------
+log = logging.getLogger(__name__)
+SECTION_CONCURRENCY = 4
+SECTION_TIMEOUT_S = 60
+SECTION_RETRIES = 2
+SECTION_BACKOFF_S = 1.5
+
+def _run_section(name: str, messages: list, use_cache: bool, timeout: float, retries: int) -> Dict[str, Any]:
+    """Una sección con reintentos y backoff exponencial; devuelve sus claves válidas
+    (las mejores obtenidas si agota los intentos, {} si ninguna).
+
+    Este bucle es el único nivel de reintento: chat() va con max_retries=0, así que una
+    sección cuesta como mucho `retries + 1` llamadas. Los errores no reintentables
+    (p.ej. 4xx de autenticación) cortan en el primer intento.
+    """
+    keys, best = SECTION_KEYS[name], {}
+    for attempt in range(retries + 1):
+        delay = SECTION_BACKOFF_S * 2 ** attempt
+        try:
+            # solo el primer intento lee la caché; se guarda únicamente la respuesta que valida
+            content = call_llm(messages, use_cache=use_cache, timeout=timeout, max_retries=0,
+                               read_cache=attempt == 0, write_cache=False)
+            data, _ = validate_sections(extract_json(content))
+            data = {k: v for k, v in data.items() if k in keys}
+            if len(data) == len(keys) and use_cache:
+                cache_answer(messages, content)
+            if len(data) > len(best):
+                best = data
+            if len(best) == len(keys):
+                return best
+            log.warning("section %s incomplete (attempt %d/%d): missing or invalid %s", name, attempt + 1,
+                        retries + 1, ", ".join(k for k in keys if k not in best))
+        except Exception as e:
+            log.warning("section %s failed (attempt %d/%d): %s", name, attempt + 1, retries + 1, e)
+            delay = llm_client.retry_delay(e, attempt)
+            if delay is None:
+                break
+        if attempt < retries:
+            time.sleep(delay)
+    return best
+
+def _fetch_sections(names: list, country, technology, capacity_mw, client, offtaker, horizon, user_context,
+                    attachments, use_cache: bool, max_concurrency: int, timeout: float, retries: int) -> dict:
+    """Lanza en paralelo las llamadas de SECTION_SPECS indicadas y fusiona sus secciones."""
+    # anexos preparados una sola vez para todas las secciones
+    attachments = prepare_attachments(attachments, country, technology, user_context)
+    jobs = {
+        name: build_messages(country, technology, capacity_mw, client, offtaker, horizon,
+                             user_context, attachments, template=SECTION_PROMPT,
+                             schema=SECTION_SPECS[name][0], requirements=SECTION_SPECS[name][1])
+        for name in names
+    }
+    data = {}
+    with ThreadPoolExecutor(max_workers=max_concurrency) as ex:
+        futures = {name: ex.submit(_run_section, name, msgs, use_cache, timeout, retries)
+                   for name, msgs in jobs.items()}
+        for name, fut in futures.items():
+            data.update(fut.result())
+    return data
+
+def request_sections(missing: list, country: str, technology: str, capacity_mw: float, client: str,
+                     offtaker: str, horizon: str, user_context: str = "", attachments: Dict[str, Any] = None,
+                     use_cache: bool = True, retries: int = 1) -> Dict[str, Any]:
+    """Vuelve a pedir solo las secciones que faltan o no validan (una llamada por SECTION_SPECS)."""
+    names = [n for n, keys in SECTION_KEYS.items() if any(k in missing for k in keys)]
+    with tracing.span("llm.repair", sections=",".join(names)) as sp:
+        data = _fetch_sections(names, country, technology, capacity_mw, client, offtaker, horizon, user_context,
+                               attachments, use_cache, SECTION_CONCURRENCY, SECTION_TIMEOUT_S, retries)
+        data = {k: v for k, v in data.items() if k in missing}
+        sp["recovered"] = len(data)
+    return data
+
+def _cache_result(messages: list, content: str, data: Dict[str, Any], missing: list):
+    # respuesta válida tal cual; si hubo que reparar secciones y quedó completa, el JSON
+    # ya reparado, para que la próxima vez no haga falta ninguna llamada
+    if not missing:
+        cache_answer(messages, content)
+    elif all(k in data for k in SECTIONS):
+        cache_answer(messages, json.dumps(data, ensure_ascii=False))
+
+def _with_raw_fallback(data: Dict[str, Any], content: str) -> Dict[str, Any]:
+    # nada aprovechable ni siquiera tras reintentar: el texto crudo va una sola vez al resumen
+    if not data and (content or "").strip():
+        return {"executive_summary": content}
+    return data
+
+def run_sectioned_analysis(
+    country: str,
+    technology: str,
+    capacity_mw: float,
+    client: str,
+    offtaker: str,
+    horizon: str,
+    user_context: str = "",
+    attachments: Dict[str, Any] = None,
+    use_cache: bool = True,
+    max_concurrency: int = SECTION_CONCURRENCY,
+    timeout: float = SECTION_TIMEOUT_S,
+    retries: int = SECTION_RETRIES
+) -> Dict[str, Any]:
+    """Lanza una llamada por sección (SECTION_SPECS) en paralelo y fusiona los JSON.
+
+    Cada sección falla por separado: la que no responde queda vacía y el resto se conserva.
+    """
+    return normalize_result(_fetch_sections(list(SECTION_SPECS), country, technology, capacity_mw, client,
+                                            offtaker, horizon, user_context, attachments, use_cache,
+                                            max_concurrency, timeout, retries))
+
+def run_strategic_analysis_stream(
+    country: str,
+    technology: str,
+    capacity_mw: float,
+    client: str,
+    offtaker: str,
+    horizon: str,
+    user_context: str = "",
+    attachments: Dict[str, Any] = None,
+    use_cache: bool = True
+):
+    """Versión en streaming: genera ("section", clave, valor) según se completa cada
+    sección y termina con ("result", None, dict) idéntico al de run_strategic_analysis."""
+    attachments = prepare_attachments(attachments, country, technology, user_context)
+    messages = build_messages(country, technology, capacity_mw, client, offtaker, horizon,
+                              user_context, attachments)
+    key = llm_cache.cache_key(messages, MODEL, 0.2) if use_cache else None
+    content = llm_cache.get(key) if key else None
+    if content is None:
+        parser = SectionStreamParser()
+        parts = []
+        t0 = time.perf_counter(); first = None
+        with tracing.span("llm.stream", model=MODEL, cache_hit=False) as sp:
+            for delta in stream_llm(messages):
+                parts.append(delta)
+                for k, v in parser.feed(delta):
+                    if k in SECTIONS:
+                        first = first or time.perf_counter() - t0
+                        yield "section", k, normalize_section(k, v)
+            sp["first_section_s"] = first
+        content = "".join(parts)
+    else:
+        tracing.event("llm.stream", model=MODEL, cache_hit=True)
+    data, missing = parse_structured(content)
+    if missing:
+        repaired = request_sections(missing, country, technology, capacity_mw, client, offtaker, horizon,
+                                    user_context, attachments, use_cache=use_cache)
+        for k, v in repaired.items():
+            yield "section", k, normalize_section(k, v)
+        data.update(repaired)
+    if key:
+        _cache_result(messages, content, data, missing)
+    res = normalize_result(_with_raw_fallback(data, content))
+    yield "result", None, res
@@ -1,10 +1,69 @@
-import os, json, streamlit as st
-from analysis import run_strategic_analysis
-from exporters import to_markdown_report, risks_to_csv_bytes, markdown_to_pdf_bytes
-from finance import quick_scenarios, sensitivity_tariff
-from visuals import risk_heatmap, pestel_radar
-from storage import save_analysis, list_analyses, load_analysis
-from advisor import ask_advisor
+import os, sys, json, importlib, tempfile, time, streamlit as st
+
+# Módulos pesados (pandas/numpy, matplotlib, openai...) se importan en el primer uso.
+# Streamlit ejecuta todo el script en cada run, así que solo se difieren de verdad si el
+# código que los usa no corre: cada vista (ver VIEWS) se ejecuta únicamente cuando está
+# seleccionada. Ver bench_imports.py para medir el arranque.
+def lazy(module: str):
+    return importlib.import_module(module)
+
+@st.cache_resource(show_spinner=False)
+def llm():
+    """Cliente OpenAI compartido, creado solo cuando hace falta una llamada."""
+    return lazy("llm_client").get_client()
+
+# --- Memoización entre reruns ---
+# Streamlit re-ejecuta el script en cada interacción: finanzas y gráficos se cachean por
+# valores de entrada, y todo lo derivado del análisis por un hash del resultado (res_key).
+def _bytes(buf):
+    return buf.getvalue() if buf else None
+
+def set_result(res: dict, params: dict = None):
+    st.session_state.res = res
+    st.session_state.params = params
+    # mismo hash que la caché de exporters, así los informes ya renderizados se reutilizan
+    st.session_state.res_key = lazy("exporters").result_hash(res)
+    st.session_state.pop("exports", None)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def finance_views(capex, opex, tariff, energy):
+    finance, visuals = lazy("finance"), lazy("visuals")
+    kpis = finance.quick_scenarios(capex, opex, tariff, energy)
+    tariffs = [tariff*0.8, tariff*0.9, tariff, tariff*1.1, tariff*1.2]
+    df_sens = finance.sensitivity_tariff(capex, opex, energy, tariffs)
+    base_case = {"Tariff": tariff, "CapEx": capex, "OpEx": opex, "Energy": energy, "Discount": 0.08}
+    grid = finance.sensitivity_grid(base_case, {k: [v*f for f in (0.8, 0.9, 1.1, 1.2)] for k, v in base_case.items()})
+    tornado_png = _bytes(visuals.tornado_chart(finance.tornado(grid, base_case), "IRR", scale=100))
+    heatmap_png = _bytes(visuals.sensitivity_heatmap(finance.grid_slice(grid, base_case, free=("Tariff", "CapEx")),
+                                                     "Tariff", "CapEx", "IRR", scale=100))
+    return kpis, df_sens, grid.to_csv(index=False).encode("utf-8"), tornado_png, heatmap_png
+
+# escenarios del modelo de cashflow, evaluados en una sola llamada: (nombre, ×tarifa, ×capex, ×energía)
+CF_SCENARIOS = [("Base", 1.0, 1.0, 1.0), ("Tariff -10%", 0.9, 1.0, 1.0), ("Tariff +10%", 1.1, 1.0, 1.0),
+                ("CapEx +10%", 1.0, 1.1, 1.0), ("Energy -10%", 1.0, 1.0, 0.9)]
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def cashflow_views(capex, opex, tariff, energy, assumptions: tuple):
+    import numpy as np
+    names, kt, kc, ke = zip(*CF_SCENARIOS)
+    summary, table = lazy("finance").cashflow_model(capex * np.array(kc), opex, tariff * np.array(kt),
+                                                    energy * np.array(ke), **dict(assumptions))
+    summary.insert(1, "name", [names[i] for i in summary["scenario"]])
+    table.insert(1, "name", [names[i] for i in table["scenario"]])
+    return summary, table, table.to_csv(index=False).encode("utf-8")
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def report_md(res_key: str, _res: dict) -> bytes:
+    return lazy("exporters").render(_res, "md", key=res_key)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def risks_csv(res_key: str, _res: dict) -> bytes:
+    return lazy("exporters").render(_res, "csv", key=res_key)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def risk_charts(res_key: str, _res: dict):
+    visuals = lazy("visuals")
+    return _bytes(visuals.risk_heatmap(_res.get("risks"))), _bytes(visuals.pestel_radar(_res.get("pestel")))
 
 st.set_page_config(page_title="QRT Strategic Analyst", page_icon="⚡", layout="wide")
 
@@ -51,29 +110,108 @@ with st.sidebar:
     energy = st.number_input("Annual energy (MWh)", min_value=0.0, value=21_000.0, step=100.0)
     tariff = st.number_input("Tariff (USD/MWh)", min_value=0.0, value=120.0, step=1.0)
 
+    parallel_mode = st.checkbox("Parallel sectioned analysis (one LLM call per section)", value=False)
+    background_mode = st.checkbox("Run in background (survives refresh; results saved to History)", value=True)
+    stream_mode = st.checkbox("Stream results as they are generated", value=True,
+                              disabled=parallel_mode or background_mode)
+    stream_mode = stream_mode and not parallel_mode and not background_mode
+    bypass_cache = st.checkbox("Bypass cache (force a fresh LLM call)", value=False)
     run_btn = st.button("Run Strategic Analysis", type="primary")
 
-tabs = st.tabs(["📊 Results", "💵 Finance", "🧯 Risk Charts", "🗂 History", "💬 Advisor"])
+# Navegación explícita en lugar de st.tabs: con pestañas Streamlit ejecuta el cuerpo de
+# todas en cada run (finanzas, gráficos, historial...); aquí solo corre la vista elegida.
+# La de rendimiento solo para administración (QRT_ADMIN=1).
+SHOW_PERF = os.getenv("QRT_ADMIN", "") == "1"
+VIEWS = ["📊 Results", "💵 Finance", "🧯 Risk Charts", "🗂 History", "💬 Advisor"] + \
+        (["⏱ Performance"] if SHOW_PERF else [])
+if run_btn and not background_mode:
+    st.session_state.view = VIEWS[0]      # el análisis se pinta en Results
+view = st.radio("View", VIEWS, key="view", horizontal=True, label_visibility="collapsed")
 
 # --- Run analysis ---
+SECTION_TITLES = {"executive_summary": "Executive Summary", "pestel": "PESTEL", "swot": "SWOT",
+                  "risks": "Top Risks (auto-prioritized)", "legal_fiscal": "Legal & Fiscal",
+                  "logistics": "Logistics & Infrastructure", "recommendations": "Recommendations"}
+
+def render_section(key, value):
+    st.subheader(SECTION_TITLES.get(key, key))
+    if key in ("pestel", "risks"): st.dataframe(value)
+    elif key == "swot":
+        for q in ["strengths", "weaknesses", "opportunities", "threats"]:
+            st.write(f"**{q.capitalize()}**"); st.write("\n".join([f"- {x}" for x in value.get(q, [])]))
+    elif key == "recommendations": st.write("\n".join([f"- {x}" for x in value]))
+    else: st.write(value)
+
+@st.cache_resource(show_spinner=False)
+def job_queue():
+    """Cola de análisis con sus hilos worker, compartida por todas las sesiones (ver jobs.py)."""
+    jobs = lazy("jobs"); llm()
+    jobs.start_workers()
+    return jobs
+
+@st.fragment(run_every=2)
+def job_panel(job_id: str):
+    # el id va en la URL: tras un refresco se sigue consultando el mismo trabajo
+    jobs = job_queue()
+    info = jobs.status(job_id)
+    if info is None:
+        del st.query_params["job"]; st.rerun()
+    if info["status"] == "done":
+        params, res = lazy("storage").load_result(info["analysis_id"])
+        set_result(res, params)
+        del st.query_params["job"]; st.rerun()
+    elif info["status"] == "error":
+        st.error(f"Analysis failed: {info['error']}")
+        if st.button("Dismiss", key="job_dismiss"):
+            del st.query_params["job"]; st.rerun()
+    else:
+        where = f"{info['queue_position']} ahead in queue" if info["status"] == "queued" else "running"
+        st.info(f"Analysis for {info['params'].get('country', '?')} · {where} · {info['elapsed_s']:.0f}s")
+
 if run_btn:
-    with st.spinner("Analyzing…"):
-        attachments = {}
-        for f in uploaded or []:
-            try: attachments[f.name] = f.read().decode("utf-8", errors="ignore")
-            except Exception: attachments[f.name] = f.getvalue()
-        res = run_strategic_analysis(
-            country=country, technology=technology, capacity_mw=capacity_mw,
-            client=client, offtaker=offtaker, horizon=horizon,
-            user_context=extra_context, attachments=attachments
-        )
-        st.session_state.res = res
-        params = dict(country=country, technology=technology, capacity_mw=capacity_mw,
-                      client=client, offtaker=offtaker, horizon=horizon, extra_context=extra_context)
-        save_analysis(params, res)
+    analysis = lazy("analysis"); llm()
+    # los ficheros se pasan tal cual: ingest los lee en streaming y elige los trozos relevantes
+    attachments = {f.name: f for f in uploaded or []}
+    kwargs = dict(country=country, technology=technology, capacity_mw=capacity_mw,
+                  client=client, offtaker=offtaker, horizon=horizon,
+                  user_context=extra_context, attachments=attachments,
+                  use_cache=not bypass_cache)
+    params = dict(country=country, technology=technology, capacity_mw=capacity_mw,
+                  client=client, offtaker=offtaker, horizon=horizon, extra_context=extra_context)
+    if background_mode:
+        # el worker guarda el resultado en storage; esta sesión solo consulta el estado
+        st.query_params["job"] = job_queue().submit(params, dict(kwargs, parallel=parallel_mode))
+    elif stream_mode:
+        # cada sección se pinta (vista Results) en cuanto se completa
+        status = st.status("Analyzing…", expanded=True)
+        for kind, key, value in analysis.run_strategic_analysis_stream(**kwargs):
+            if kind == "section":
+                with status: render_section(key, value)
+            else:
+                res = value
+        status.update(label="Analysis complete", state="complete")
+    else:
+        with st.spinner("Analyzing…"):
+            res = analysis.run_strategic_analysis(**kwargs, parallel=parallel_mode)
+    if not background_mode:
+        set_result(res, params)
+        lazy("storage").save_analysis(params, res)
+    if stream_mode:
+        st.rerun()
+if "job" in st.query_params:
+    with st.sidebar:
+        job_panel(st.query_params["job"])
+if "llm_cache" in sys.modules:
+    # solo si ya hubo llamadas al LLM en este proceso: importarlo arrastra storage y pandas
+    cs = lazy("llm_cache").cache_stats()
+    st.sidebar.caption(f"LLM cache: {cs['hits']} hits · {cs['misses']} misses · {cs['entries']} entries")
 
-# --- TAB 1: Results ---
-with tabs[0]:
+# --- VIEW 1: Results ---
+EXPORT_FORMATS = {"pdf": "PDF", "docx": "Word", "xlsx": "Excel", "html": "HTML"}
+EXPORT_NEEDS = {"pdf": "requires wkhtmltopdf on host", "docx": "requires python-docx",
+                "xlsx": "requires openpyxl", "html": "requires markdown"}
+
+if view == VIEWS[0]:
     if "res" not in st.session_state:
         st.info("Enter project details in the sidebar and click **Run Strategic Analysis**.")
     else:
@@ -101,70 +239,263 @@ with tabs[0]:
         with col2:
             st.subheader("Top Risks (auto-prioritized)")
             st.dataframe(res.get("risks"))
-            md = to_markdown_report(res)
-            st.download_button("⬇️ Download Report (Markdown)", md.encode("utf-8"), file_name="QRT_Strategic_Analysis.md")
-            csv_bytes = risks_to_csv_bytes(res.get("risks"))
-            st.download_button("⬇️ Download Risks (CSV)", csv_bytes, file_name="QRT_Risks.csv", mime="text/csv")
-            pdf_bytes = markdown_to_pdf_bytes(md)
-            if pdf_bytes:
-                st.download_button("⬇️ Download Report (PDF)", pdf_bytes, file_name="QRT_Strategic_Analysis.pdf", mime="application/pdf")
+            key = st.session_state.res_key
+            st.download_button("⬇️ Download Report (Markdown)", report_md(key, res), file_name="QRT_Strategic_Analysis.md")
+            st.download_button("⬇️ Download Risks (CSV)", risks_csv(key, res), file_name="QRT_Risks.csv", mime="text/csv")
+            # PDF (wkhtmltopdf), Word, Excel y HTML se generan en segundo plano solo cuando se piden
+            exporters = lazy("exporters")
+            if "exports" not in st.session_state:
+                if st.button("Prepare PDF / Word / Excel / HTML"):
+                    st.session_state.exports = exporters.render_all(res, EXPORT_FORMATS, key=key)
+                    st.rerun()
             else:
-                st.caption("PDF export optional (requires wkhtmltopdf on host).")
+                futs = st.session_state.exports
+                for fmt, label in EXPORT_FORMATS.items():
+                    fut = futs[fmt]
+                    if not fut.done():
+                        st.caption(f"{label}: rendering…")
+                    elif fut.exception() is None and fut.result():
+                        st.download_button(f"⬇️ Download Report ({label})", fut.result(),
+                                           file_name=f"QRT_Strategic_Analysis.{fmt}", mime=exporters.MIME[fmt])
+                    else:
+                        st.caption(f"{label} export unavailable ({EXPORT_NEEDS[fmt]}).")
+                if not all(f.done() for f in futs.values()) and st.button("Refresh exports"):
+                    st.rerun()
 
-# --- TAB 2: Finance ---
-with tabs[1]:
+# --- VIEW 2: Finance ---
+if view == VIEWS[1]:
     st.subheader("Quick Finance KPIs")
-    kpis = quick_scenarios(capex, opex, tariff, energy)
+    kpis, df_sens, grid_csv, tornado_png, heatmap_png = finance_views(capex, opex, tariff, energy)
     st.metric("IRR (simple)", f"{kpis['IRR']*100:.2f}%")
     st.metric("LCOE (USD/MWh)", f"{kpis['LCOE']:.2f}")
     st.metric("Annual Cashflow (USD)", f"{kpis['AnnualCashflow']:,.0f}")
     st.divider()
     st.write("Sensitivity: Tariff vs IRR")
-    tariffs = [tariff*0.8, tariff*0.9, tariff, tariff*1.1, tariff*1.2]
-    df_sens = sensitivity_tariff(capex, opex, energy, tariffs)
     st.line_chart(df_sens.set_index("Tariff")["IRR"])
+    st.divider()
+    st.write("Sensitivity grid: Tariff × CapEx × OpEx × Energy × Discount (±20%)")
+    g1, g2 = st.columns(2)
+    if tornado_png: g1.image(tornado_png)
+    if heatmap_png: g2.image(heatmap_png)
+    st.download_button("⬇️ Download Sensitivity Grid (CSV)", grid_csv,
+                       file_name="QRT_Sensitivity_Grid.csv", mime="text/csv")
+    st.divider()
+    st.write("Year-by-year cashflow model (degradation, escalation, sculpted debt, depreciation, tax)")
+    with st.expander("Assumptions", expanded=False):
+        a1, a2, a3, a4 = st.columns(4)
+        cf_a = dict(
+            years=a1.number_input("Life (yrs)", min_value=5, max_value=40, value=25, step=1),
+            discount=a1.number_input("Discount rate (%)", min_value=0.0, max_value=30.0, value=8.0, step=0.5) / 100,
+            degradation=a1.number_input("Degradation (%/yr)", min_value=0.0, max_value=5.0, value=0.5, step=0.1,
+                                        key="cf_degradation") / 100,
+            tariff_escalation=a2.number_input("Tariff escalation (%/yr)", min_value=-5.0, max_value=10.0,
+                                              value=0.0, step=0.25) / 100,
+            opex_escalation=a2.number_input("OpEx escalation (%/yr)", min_value=-5.0, max_value=10.0,
+                                            value=2.0, step=0.25) / 100,
+            augmentation_capex=a2.number_input("Augmentation CapEx (USD)", min_value=0.0, value=0.0, step=100_000.0),
+            augmentation_every=a2.number_input("Augmentation every (yrs, 0 = none)", min_value=0, max_value=20,
+                                               value=0, step=1),
+            gearing=a3.number_input("Max gearing (%)", min_value=0.0, max_value=100.0, value=70.0, step=5.0) / 100,
+            debt_rate=a3.number_input("Debt rate (%)", min_value=0.0, max_value=20.0, value=6.5, step=0.25) / 100,
+            debt_tenor=a3.number_input("Debt tenor (yrs)", min_value=1, max_value=30, value=15, step=1),
+            target_dscr=a3.number_input("Target DSCR", min_value=1.0, max_value=3.0, value=1.30, step=0.05),
+            depreciation_years=a4.number_input("Depreciation (yrs)", min_value=1, max_value=40, value=20, step=1),
+            tax_rate=a4.number_input("Corporate tax (%)", min_value=0.0, max_value=60.0, value=25.0, step=1.0) / 100,
+        )
+    cf_summary, cf_table, cf_csv = cashflow_views(capex, opex, tariff, energy, tuple(sorted(cf_a.items())))
+    base = cf_summary.iloc[0]
+    k1, k2, k3, k4 = st.columns(4)
+    k1.metric("Project IRR (post-tax)", f"{base['ProjectIRR']*100:.2f}%")
+    k2.metric("Equity IRR", f"{base['EquityIRR']*100:.2f}%")
+    k3.metric("Equity NPV (USD)", f"{base['EquityNPV']:,.0f}")
+    k4.metric("Min DSCR", f"{base['MinDSCR']:.2f}x" if base["MinDSCR"] == base["MinDSCR"] else "n/a")
+    st.dataframe(cf_summary.drop(columns="scenario").set_index("name"))
+    base_rows = cf_table[cf_table["scenario"] == 0].set_index("year")
+    st.line_chart(base_rows[["cfads", "debt_service", "equity_cf"]])
+    with st.expander("Base case cashflow table"):
+        st.dataframe(base_rows.drop(columns=["scenario", "name"]).round(2))
+    st.download_button("⬇️ Download Cashflow Model (CSV)", cf_csv, file_name="QRT_Cashflow_Model.csv",
+                       mime="text/csv")
+    st.divider()
+    st.write("Monte Carlo (CapEx, OpEx, energy yield with degradation, tariff)")
+    mc1, mc2, mc3, mc4 = st.columns(4)
+    n_paths = mc1.number_input("Paths", min_value=1_000, max_value=5_000_000, value=200_000, step=50_000)
+    degradation = mc2.number_input("Degradation (%/yr)", min_value=0.0, max_value=5.0, value=0.5, step=0.1) / 100
+    payback_n = mc3.number_input("Payback within (yrs)", min_value=1, max_value=25, value=10, step=1)
+    mc_seed = mc4.number_input("Seed", min_value=0, value=42, step=1)
+    if st.button("Run Monte Carlo"):
+        with st.spinner("Simulating…"):
+            mc = lazy("simulation").monte_carlo(capex, opex, tariff, energy, n_paths=int(n_paths),
+                                                degradation=degradation, payback_within=int(payback_n),
+                                                seed=int(mc_seed), workers=os.cpu_count() or 1)
+            # histogramas renderizados una vez por simulación, no en cada rerun
+            visuals = lazy("visuals")
+            mc["png_IRR"] = _bytes(visuals.mc_histogram(mc["hist_IRR"], mc["IRR"], "IRR distribution", "IRR (%)", scale=100))
+            mc["png_LCOE"] = _bytes(visuals.mc_histogram(mc["hist_LCOE"], mc["LCOE"], "LCOE distribution", "USD/MWh"))
+            st.session_state.mc = mc
+    if "mc" in st.session_state:
+        mc = st.session_state.mc
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("IRR P10", f"{mc['IRR']['P10']*100:.2f}%")
+        c2.metric("IRR P50", f"{mc['IRR']['P50']*100:.2f}%")
+        c3.metric("IRR P90", f"{mc['IRR']['P90']*100:.2f}%")
+        c4.metric(f"P(payback ≤ {mc['payback_within']} yrs)", f"{mc['prob_payback']*100:.1f}%")
+        st.caption(f"LCOE P10/P50/P90: {mc['LCOE']['P10']:.2f} / {mc['LCOE']['P50']:.2f} / {mc['LCOE']['P90']:.2f} USD/MWh · {mc['n_paths']:,} paths · seed {mc['seed']}")
+        h1, h2 = st.columns(2)
+        if mc["png_IRR"]: h1.image(mc["png_IRR"])
+        if mc["png_LCOE"]: h2.image(mc["png_LCOE"])
 
-# --- TAB 3: Risk Charts ---
-with tabs[2]:
+# --- VIEW 3: Risk Charts ---
+if view == VIEWS[2]:
     if "res" in st.session_state:
+        heat_png, radar_png = risk_charts(st.session_state.res_key, st.session_state.res)
         st.subheader("Risk Heatmap")
-        buf = risk_heatmap(st.session_state.res.get("risks"))
-        if buf: st.image(buf)
+        fig = None
+        if st.toggle("Interactive heatmap (Plotly)", value=False):
+            fig = lazy("visuals").risk_heatmap_figure(st.session_state.res.get("risks"))
+            if fig is None: st.caption("Plotly not installed; showing the static chart.")
+        if fig is not None: st.plotly_chart(fig, use_container_width=True)
+        elif heat_png: st.image(heat_png)
         st.subheader("PESTEL Radar")
-        buf2 = pestel_radar(st.session_state.res.get("pestel"))
-        if buf2: st.image(buf2)
+        if radar_png: st.image(radar_png)
     else:
         st.info("Run an analysis to see charts.")
 
-# --- TAB 4: History ---
-with tabs[3]:
+# --- VIEW 4: History ---
+HISTORY_PAGE = 25
+
+if view == VIEWS[3]:
     st.subheader("Saved Analyses")
-    df = list_analyses()
-    if df is None or df.empty:
-        st.caption("No analyses saved yet.")
+    storage = lazy("storage")
+    facets = storage.history_facets()
+    f1, f2, f3, f4 = st.columns(4)
+    h_country = f1.selectbox("Country", [""] + facets["country"], key="h_country")
+    h_tech = f2.selectbox("Technology", [""] + facets["technology"], key="h_tech")
+    h_dates = f3.date_input("Date range", value=(), key="h_dates")
+    h_score = f4.number_input("Min risk score", min_value=0.0, max_value=25.0, value=0.0, step=1.0, key="h_score")
+    h_search = st.text_input("Search executive summaries", key="h_search")
+    filters = dict(country=h_country or None, technology=h_tech or None,
+                   date_from=h_dates[0] if len(h_dates) > 0 else None,
+                   date_to=h_dates[1] if len(h_dates) > 1 else None,
+                   min_risk_score=h_score or None, search=h_search or None)
+    # pila de cursores (before_id) por página; se reinicia al cambiar los filtros
+    fkey = json.dumps(filters, default=str, sort_keys=True)
+    if st.session_state.get("h_filters") != fkey:
+        st.session_state.h_filters = fkey
+        st.session_state.h_cursors = [None]
+    cursors = st.session_state.h_cursors
+    df, next_cursor = storage.page_analyses(before_id=cursors[-1], limit=HISTORY_PAGE, **filters)
+    if df.empty:
+        st.caption("No analyses match these filters." if len(cursors) > 1 or any(filters.values())
+                   else "No analyses saved yet.")
     else:
-        st.dataframe(df)
-        sel = st.number_input("Open analysis ID", min_value=1, step=1)
-        if st.button("Load"):
+        st.dataframe(df, hide_index=True)
+        p1, p2, p3 = st.columns([1, 1, 4])
+        if p1.button("◀ Newer", disabled=len(cursors) == 1):
+            cursors.pop(); st.rerun()
+        if p2.button("Older ▶", disabled=next_cursor is None):
+            cursors.append(next_cursor); st.rerun()
+        p3.caption(f"Page {len(cursors)}")
+        sel = st.selectbox("Open analysis ID", df["id"].tolist())
+        o1, o2 = st.columns(2)
+        if o1.button("Show summary"):
             try:
-                row = load_analysis(int(sel))
+                row = storage.load_analysis(int(sel), columns=["id", "ts", "exec_summary"])
                 st.json({"id": int(sel), "timestamp": row["ts"]})
                 st.text_area("Executive Summary", value=row["exec_summary"], height=200)
             except Exception as e:
                 st.error(str(e))
+        if o2.button("Reload into Results"):
+            try:
+                past_params, past = storage.load_result(int(sel))
+                set_result(past, past_params)
+                st.session_state.h_loaded = int(sel)
+                st.rerun()      # para que Results y Risk Charts pinten el análisis recargado
+            except Exception as e:
+                st.error(str(e))
+        if "h_loaded" in st.session_state:
+            st.success(f"Analysis {st.session_state.pop('h_loaded')} loaded — see the Results, Risk Charts and Advisor views.")
 
-# --- TAB 5: Advisor ---
-with tabs[4]:
+    with st.expander("Export analyses in a date range (ZIP)"):
+        z1, z2 = st.columns(2)
+        z_dates = z1.date_input("Saved between", value=(), key="z_dates")
+        z_formats = z2.multiselect("Formats", ["md", "html", "pdf", "docx", "xlsx", "csv"], default=["md", "csv"])
+        if st.button("Build ZIP") and z_formats:
+            # el ZIP se escribe por trozos a disco; en memoria solo los informes en curso.
+            # Un fichero por sesión (todas comparten proceso); el anterior se borra al sustituirlo
+            with tempfile.NamedTemporaryFile(prefix="qrt_reports_", suffix=".zip", delete=False) as tmp:
+                path = tmp.name
+            with st.spinner("Rendering reports…"):
+                lazy("exporters").export_zip(path, date_from=z_dates[0] if len(z_dates) > 0 else None,
+                                             date_to=z_dates[1] if len(z_dates) > 1 else None,
+                                             formats=z_formats)
+            old_zip = st.session_state.get("zip_path")
+            st.session_state.zip_path = path
+            if old_zip and os.path.exists(old_zip):
+                os.remove(old_zip)
+        if st.session_state.get("zip_path") and os.path.exists(st.session_state.zip_path):
+            with open(st.session_state.zip_path, "rb") as f:
+                st.download_button("⬇️ Download ZIP", f, file_name="QRT_Reports.zip", mime="application/zip")
+
+    with st.expander("Portfolio risk analytics (all saved analyses)"):
+        ra = lazy("risk_analytics")
+        freq = ra.frequency(by=("category",))
+        if freq.empty:
+            st.caption("No risks stored yet.")
+        else:
+            st.write("Risk frequency by category")
+            st.dataframe(freq, hide_index=True)
+            st.write("Risk count by category × country")
+            st.dataframe(ra.frequency_matrix())
+            st.write("Average probability / impact over time")
+            st.line_chart(ra.trends().set_index("month")[["avg_probability", "avg_impact"]])
+            st.write("Most recurrent mitigations")
+            st.dataframe(ra.top_mitigations(10), hide_index=True)
+
+# --- VIEW 5: Advisor ---
+if view == VIEWS[4]:
     if "res" not in st.session_state:
         st.info("Run analysis first.")
     else:
         st.subheader("QRT Advisor Chat")
+        # una sesión por resultado: contexto indexado una vez y memoria de la conversación
+        if st.session_state.get("advisor_key") != st.session_state.res_key:
+            st.session_state.advisor = lazy("advisory").AdvisorSession(st.session_state.res,
+                                                                       st.session_state.get("params"))
+            st.session_state.advisor_key = st.session_state.res_key
+        advisor = st.session_state.advisor
+        for m in advisor.history:
+            with st.chat_message(m["role"]):
+                st.write(m["content"])
         q = st.text_area("Ask a question about this project or country/regulatory context:")
-        if st.button("Ask Advisor"):
-            with st.spinner("Thinking..."):
-                ctx = json.dumps(st.session_state.res, default=str)[:10000]
-                a = ask_advisor(q, ctx)  # pregunta, luego contexto
-                st.write(a)
+        a1, a2 = st.columns([1, 4])
+        if a1.button("Ask Advisor") and q.strip():
+            llm()
+            with st.chat_message("user"):
+                st.write(q)
+            with st.chat_message("assistant"):
+                st.write_stream(advisor.ask_stream(q))
+            st.caption(f"~{advisor.last_prompt_tokens:,} prompt tokens (retrieved excerpts + recent history)")
+        if advisor.history and a2.button("Clear conversation"):
+            advisor.reset(); st.rerun()
+
+# --- VIEW 6: Performance (admin) ---
+if SHOW_PERF and view == VIEWS[5]:
+    tracing = lazy("tracing")
+    window = st.selectbox("Window", ["Last hour", "Last 24 hours", "Last 7 days", "All"], index=1)
+    since = {"Last hour": 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400}.get(window)
+    since = time.time() - since if since else None
+    perf = tracing.stats(since)
+    if perf.empty:
+        st.caption("No spans recorded yet.")
+    else:
+        st.dataframe(perf, hide_index=True)
+        st.bar_chart(perf.set_index("stage")[["p50_ms", "p95_ms"]])
+        st.download_button("⬇️ Prometheus snapshot", tracing.prometheus_text(since),
+                           file_name="qrt_metrics.prom", mime="text/plain")
+    u = lazy("llm_client").usage_snapshot()
+    st.caption(f"LLM: {u['calls']} calls · {u['retries']} retries · {u['total_tokens']:,} tokens · "
+               f"avg {u['avg_latency_s']:.2f}s · success {u['success_rate']*100:.0f}%")
 
 st.markdown("<hr>", unsafe_allow_html=True)
 st.caption("© 2025 QRT Strategic Analyst · v2.0 Pro")
@@ -0,0 +1,206 @@
+# batch.py — análisis de cartera: muchos proyectos desde CSV/JSONL, sin Streamlit
+#
+#   python batch.py projects.csv --out portfolio_risks.csv --workers 4 --rpm 30
+#   python batch.py projects.jsonl --stub          # LLM simulado, para pruebas
+#
+# Columnas/campos: country, technology, capacity_mw, client, offtaker, horizon,
+# extra_context y opcionalmente capex, opex, energy, tariff (finanzas rápidas).
+
+import argparse, hashlib, json, os, re, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+import analysis, llm_client
+from analysis import run_strategic_analysis, normalize_result
+from finance import quick_scenarios
+from storage import save_analyses
+
+PARAM_KEYS = ["country", "technology", "capacity_mw", "client", "offtaker", "horizon", "extra_context"]
+FINANCE_DEFAULTS = {"capex": 12_000_000.0, "opex": 300_000.0, "energy": 21_000.0, "tariff": 120.0}
+
+def read_projects(path: str) -> list:
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        rows = pd.read_csv(path).replace({np.nan: None}).to_dict("records")
+    projects = []
+    for r in rows:
+        p = {k: r.get(k) or "" for k in PARAM_KEYS}
+        p["capacity_mw"] = float(r.get("capacity_mw") or 0.0)
+        for k, v in FINANCE_DEFAULTS.items():
+            p[k] = float(r[k]) if r.get(k) not in (None, "") else v
+        projects.append(p)
+    return projects
+
+def project_key(p: dict) -> str:
+    return hashlib.sha256(json.dumps(p, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+def _to_jsonable(res: dict) -> dict:
+    return {k: (v.to_dict("records") if isinstance(v, pd.DataFrame) else v) for k, v in res.items()}
+
+class RateLimiter:
+    """Espacia los inicios de llamada para no superar `per_minute` (compartido entre hilos)."""
+    def __init__(self, per_minute: float = None):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+def _load_checkpoint(path: str):
+    done, saved = {}, set()
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                if "saved" in rec:
+                    saved.update(rec["saved"])
+                else:
+                    done[rec["key"]] = rec
+    return done, saved
+
+def run_batch(projects: list, max_workers: int = 4, rate_per_min: float = None,
+              checkpoint: str = None, use_cache: bool = True, parallel: bool = False,
+              progress_cb=None) -> dict:
+    """Ejecuta run_strategic_analysis por proyecto con concurrencia acotada.
+
+    Cada proyecto terminado se añade a `checkpoint` (JSONL); al relanzar se salta lo ya
+    hecho. Al final se guardan en `storage` en una sola transacción los que aún no lo estaban.
+    Devuelve {"results", "portfolio", "risks", "metrics"}.
+    """
+    done, saved = _load_checkpoint(checkpoint)
+    # filas repetidas en la entrada: un solo análisis (y un solo guardado) por proyecto
+    unique = dict(zip((project_key(p) for p in projects), projects))
+    keys = list(unique)
+    pending = [(k, p) for k, p in unique.items() if k not in done]
+    limiter = RateLimiter(rate_per_min)
+    ck_lock = threading.Lock()
+    tokens0 = llm_client.usage["total_tokens"]
+    t0 = time.monotonic()
+    errors = {}
+
+    def work(key, p):
+        limiter.wait()
+        res = run_strategic_analysis(
+            country=p["country"], technology=p["technology"], capacity_mw=p["capacity_mw"],
+            client=p["client"], offtaker=p["offtaker"], horizon=p["horizon"],
+            user_context=p["extra_context"], use_cache=use_cache, parallel=parallel)
+        rec = {"key": key, "params": p, "res": _to_jsonable(res)}
+        if checkpoint:
+            with ck_lock, open(checkpoint, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, default=str) + "\n")
+        return rec
+
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        futures = {ex.submit(work, k, p): k for k, p in pending}
+        for n, fut in enumerate(as_completed(futures), start=1):
+            try:
+                rec = fut.result(); done[rec["key"]] = rec
+            except Exception as e:
+                errors[futures[fut]] = str(e)
+            if progress_cb:
+                progress_cb(n, len(pending), _metrics(n, t0, tokens0))
+
+    results = [(k, done[k]["params"], normalize_result(done[k]["res"])) for k in keys if k in done]
+
+    # guardado masivo en una transacción
+    to_save = [(k, p, r) for k, p, r in results if k not in saved]
+    if to_save:
+        save_analyses([(p, r) for _, p, r in to_save])
+        if checkpoint:
+            with open(checkpoint, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"saved": [k for k, _, _ in to_save]}) + "\n")
+
+    # finanzas rápidas de toda la cartera en una sola pasada vectorizada
+    portfolio = pd.DataFrame([{"key": k, **{c: p[c] for c in ["country", "technology", "capacity_mw"]},
+                               **{c: p[c] for c in FINANCE_DEFAULTS}} for k, p, _ in results])
+    if not portfolio.empty:
+        kp = quick_scenarios(portfolio["capex"].to_numpy(), portfolio["opex"].to_numpy(),
+                             portfolio["tariff"].to_numpy(), portfolio["energy"].to_numpy())
+        portfolio["IRR"] = kp["IRR"]; portfolio["LCOE"] = kp["LCOE"]; portfolio["Payback"] = kp["Payback"]
+        portfolio["n_risks"] = [len(r["risks"]) for _, _, r in results]
+        portfolio["P1_risks"] = [int((r["risks"].get("priority") == "P1").sum()) if "priority" in r["risks"] else 0
+                                 for _, _, r in results]
+
+    risk_frames = [r["risks"].assign(key=k, country=p["country"], technology=p["technology"],
+                                     capacity_mw=p["capacity_mw"])
+                   for k, p, r in results if isinstance(r["risks"], pd.DataFrame) and not r["risks"].empty]
+    risks = pd.concat(risk_frames, ignore_index=True) if risk_frames else pd.DataFrame()
+
+    return {"results": results, "portfolio": portfolio, "risks": risks, "errors": errors,
+            "metrics": _metrics(len(pending) - len(errors), t0, tokens0)}
+
+def _metrics(n_done: int, t0: float, tokens0: int) -> dict:
+    mins = max(time.monotonic() - t0, 1e-9) / 60
+    tokens = llm_client.usage["total_tokens"] - tokens0
+    return {"projects": n_done, "elapsed_s": round(mins * 60, 2),
+            "projects_per_min": n_done / mins, "tokens": tokens, "tokens_per_min": tokens / mins}
+
+# ---------------------------------
+# LLM simulado (modo --stub)
+# ---------------------------------
+def stub_call_llm(messages: list, temperature: float = 0.2, use_cache: bool = False, timeout: float = None,
+                  **kw) -> str:
+    """Respuesta determinista con el esquema completo, derivada del prompt."""
+    prompt = messages[-1]["content"]
+    country = (re.search(r"- Country: (.*)", prompt) or [None, "?"])[1]
+    tech = (re.search(r"- Technology: (.*)", prompt) or [None, "?"])[1]
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    rng = np.random.default_rng(seed)
+    cats = ["Regulatory", "Technical", "Financial", "Fiscal", "Environmental", "Logistic", "Social/Stakeholder"]
+    return json.dumps({
+        "executive_summary": f"[stub] {tech} project in {country}.",
+        "pestel": [{"factor": f, "points": ["stub"], "assessment": "stub"}
+                   for f in ["Political", "Economic", "Social", "Technological", "Environmental", "Legal"]],
+        "swot": {"strengths": ["stub"], "weaknesses": ["stub"], "opportunities": ["stub"], "threats": ["stub"]},
+        "risks": [{"category": c, "risk": f"[stub] {c} risk", "probability": int(rng.integers(1, 6)),
+                   "impact": int(rng.integers(1, 6)), "mitigation": "stub"} for c in cats],
+        "legal_fiscal": "[stub]", "logistics": "[stub]", "recommendations": ["[stub]"],
+    })
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="QRT batch portfolio analysis")
+    ap.add_argument("projects", help="CSV or JSONL with one project per row")
+    ap.add_argument("--out", default="portfolio_risks.csv", help="consolidated portfolio risk table (CSV)")
+    ap.add_argument("--summary", default="portfolio_summary.csv", help="per-project KPIs (CSV)")
+    ap.add_argument("--checkpoint", default=None, help="JSONL checkpoint (default: <projects>.ckpt.jsonl)")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--rpm", type=float, default=None, help="max analyses started per minute")
+    ap.add_argument("--parallel", action="store_true", help="sectioned analysis (one call per section)")
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--stub", action="store_true", help="use a deterministic fake LLM (no network)")
+    a = ap.parse_args(argv)
+
+    if a.stub:
+        analysis.call_llm = stub_call_llm
+    projects = read_projects(a.projects)
+
+    def progress(n, total, m):
+        print(f"\r{n}/{total} · {m['projects_per_min']:.1f} projects/min · {m['tokens_per_min']:.0f} tokens/min",
+              end="", file=sys.stderr, flush=True)
+
+    out = run_batch(projects, max_workers=a.workers, rate_per_min=a.rpm,
+                    checkpoint=a.checkpoint or a.projects + ".ckpt.jsonl",
+                    use_cache=not a.no_cache, parallel=a.parallel, progress_cb=progress)
+    print(file=sys.stderr)
+    out["risks"].to_csv(a.out, index=False)
+    out["portfolio"].to_csv(a.summary, index=False)
+    for k, e in out["errors"].items():
+        print(f"FAILED {k}: {e}", file=sys.stderr)
+    print(json.dumps(out["metrics"]))
+    return 1 if out["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
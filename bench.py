@@ -0,0 +1,255 @@
+# bench.py — benchmarks offline de las rutas calientes (finanzas, riesgos, storage, exportación)
+#
+#   python bench.py                                  # todo, escala "small" (10k filas)
+#   python bench.py --scale full                     # 100k filas en storage/riesgos
+#   python bench.py finance risk --repeat 5          # solo algunos grupos
+#   python bench.py --json base.json                 # guarda una línea base
+#   python bench.py --baseline base.json --threshold 0.25   # falla si algo empeora >25%
+#
+# Sin red: el LLM se sustituye por batch.stub_call_llm y la base de datos va a un
+# directorio temporal. Cada caso informa la mediana de `--repeat` ejecuciones, el
+# throughput (elementos/s) y el pico de memoria Python (tracemalloc, en una pasada aparte).
+
+import argparse, atexit, json, os, shutil, statistics, sys, tempfile, time, tracemalloc
+
+os.environ.setdefault("QRT_TRACE_SINK", "off")        # los spans no cuentan en el benchmark
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+import numpy as np
+import pandas as pd
+
+SCALES = {"small": {"rows": 10_000, "paths": 100_000}, "full": {"rows": 100_000, "paths": 1_000_000}}
+GROUPS = ["finance", "risk", "storage", "export", "analysis"]
+CASES = {}          # nombre -> (grupo, setup(scale) -> (fn, n_items))
+
+def case(name: str, group: str):
+    def deco(setup):
+        CASES[name] = (group, setup)
+        return setup
+    return deco
+
+# ---------------------------------
+# Datos sintéticos
+# ---------------------------------
+def _stub_result(i: int = 0) -> dict:
+    import analysis, batch
+    prompt = f"- Country: C{i % 40}\n- Technology: T{i % 5}"
+    return analysis.normalize_result(json.loads(batch.stub_call_llm([{"content": prompt}])))
+
+def _risk_table(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    cats = np.array(["Regulatory", "Technical", "Financial", "Fiscal", "Environmental", "Logistic"])
+    prob = rng.integers(1, 6, n).astype(object)
+    prob[rng.random(n) < 0.02] = "3/5"          # algo de ruido como el que devuelve el LLM
+    return pd.DataFrame({"category": cats[rng.integers(0, len(cats), n)], "risk": "synthetic risk",
+                         "probability": prob, "impact": rng.integers(1, 6, n), "mitigation": "hedge"})
+
+# ---------------------------------
+# Casos
+# ---------------------------------
+@case("finance.lcoe", "finance")
+def _(scale):
+    import finance
+    n = scale["paths"]
+    rng = np.random.default_rng(1)
+    capex, opex, energy = rng.uniform(5e6, 2e7, n), rng.uniform(1e5, 5e5, n), rng.uniform(1e4, 4e4, n)
+    return lambda: finance.lcoe(capex, opex, energy, degradation=0.005), n
+
+@case("finance.irr_from_cashflows", "finance")
+def _(scale):
+    import finance
+    n = scale["rows"]
+    rng = np.random.default_rng(2)
+    capex = rng.uniform(8e6, 1.5e7, n)
+    flows = rng.uniform(8e5, 2e6, (n, 25))
+    return lambda: finance.irr_from_cashflows(capex, flows), n
+
+@case("finance.sensitivity_tariff", "finance")
+def _(scale):
+    import finance
+    tariffs = np.linspace(60, 200, scale["rows"]).tolist()
+    return lambda: finance.sensitivity_tariff(12e6, 3e5, 21_000, tariffs), len(tariffs)
+
+@case("finance.sensitivity_grid", "finance")
+def _(scale):
+    import finance
+    base = {"Tariff": 120.0, "CapEx": 12e6, "OpEx": 3e5, "Energy": 21_000.0, "Discount": 0.08}
+    ranges = {k: list(np.linspace(0.8, 1.2, 7) * v) for k, v in base.items()}
+    return lambda: finance.sensitivity_grid(base, ranges), 7 ** 5
+
+@case("finance.monte_carlo", "finance")
+def _(scale):
+    import simulation
+    n = scale["paths"]
+    return lambda: simulation.monte_carlo(12e6, 3e5, 120.0, 21_000.0, n_paths=n, degradation=0.005, seed=7), n
+
+@case("finance.cashflow_model", "finance")
+def _(scale):
+    import finance
+    n = scale["rows"]
+    rng = np.random.default_rng(5)
+    capex, tariff = rng.uniform(8e6, 1.5e7, n), rng.uniform(80, 160, n)
+    return lambda: finance.cashflow_model(capex, 3e5, tariff, 21_000, detail=False, augmentation_capex=1e6,
+                                          augmentation_every=10, tariff_escalation=0.01), n
+
+@case("risk.score_risks", "risk")
+def _(scale):
+    import risk_matrix
+    df = _risk_table(scale["rows"] * 10)
+    return lambda: risk_matrix.score_risks(df), len(df)
+
+@case("risk.bin_matrix", "risk")
+def _(scale):
+    import risk_matrix
+    df = risk_matrix.score_risks(_risk_table(scale["rows"] * 10))
+    return lambda: risk_matrix.bin_matrix(df), len(df)
+
+@case("risk.risk_heatmap_cold", "risk")
+def _(scale):
+    import risk_matrix, visuals
+    df = risk_matrix.score_risks(_risk_table(scale["rows"]))
+    def run():
+        visuals._render_cache.clear(); visuals._render_cache_bytes = 0
+        return visuals.risk_heatmap(df)
+    return run, len(df)
+
+@case("risk.risk_heatmap_cached", "risk")
+def _(scale):
+    import risk_matrix, visuals
+    df = risk_matrix.score_risks(_risk_table(scale["rows"], seed=3))
+    visuals.risk_heatmap(df)
+    return lambda: visuals.risk_heatmap(df), len(df)
+
+def _fresh_db(tag: str) -> str:
+    import storage
+    storage.DB_PATH = os.path.join(_TMP, f"bench_{tag}_{time.perf_counter_ns()}.db")
+    return storage.DB_PATH
+
+@case("storage.save_analyses_bulk", "storage")
+def _(scale):
+    import storage
+    items = [({"country": f"C{i % 40}", "technology": f"T{i % 5}", "capacity_mw": 10.0}, _stub_result(i % 200))
+             for i in range(scale["rows"])]
+    def run():
+        _fresh_db("bulk")
+        storage.save_analyses(items)
+    return run, len(items)
+
+@case("storage.save_analysis_single", "storage")
+def _(scale):
+    import storage
+    _fresh_db("single")
+    res = _stub_result()
+    storage.save_analyses([({"country": f"C{i % 40}", "technology": "T1"}, res) for i in range(scale["rows"])])
+    n = 50
+    def run():
+        for _ in range(n):
+            storage.save_analysis({"country": "C1", "technology": "T1"}, res)
+    return run, n
+
+@case("storage.list_and_page", "storage")
+def _(scale):
+    import storage
+    _fresh_db("page")
+    res = _stub_result()
+    storage.save_analyses([({"country": f"C{i % 40}", "technology": f"T{i % 5}"}, res) for i in range(scale["rows"])])
+    def run():
+        storage.list_analyses(50)
+        df, cursor = storage.page_analyses(limit=25)
+        for _ in range(20):
+            df, cursor = storage.page_analyses(before_id=cursor, limit=25, country="C3", min_risk_score=10)
+            if cursor is None:
+                break
+        storage.page_analyses(limit=25, search="project")
+        storage.load_result(int(df["id"].iloc[0]) if len(df) else 1)
+    return run, 23
+
+@case("export.to_markdown_report", "export")
+def _(scale):
+    import exporters
+    results = [_stub_result(i) for i in range(200)]
+    return lambda: [exporters.to_markdown_report(r) for r in results], len(results)
+
+@case("export.html", "export")
+def _(scale):
+    import exporters
+    results = [_stub_result(i) for i in range(200)]
+    return lambda: [exporters.markdown_to_html(exporters.to_markdown_report(r)) for r in results], len(results)
+
+@case("export.pdf", "export")
+def _(scale):
+    import exporters
+    if exporters._pdfkit() is None:
+        return None, 0                      # sin wkhtmltopdf en este host
+    md = exporters.to_markdown_report(_stub_result())
+    return lambda: [exporters.markdown_to_pdf_bytes(md) for _ in range(5)], 5
+
+@case("analysis.run_stub", "analysis")
+def _(scale):
+    import analysis, batch
+    analysis.call_llm = batch.stub_call_llm
+    n = 200
+    return lambda: [analysis.run_strategic_analysis(f"C{i}", "Solar PV", 10.0, "c", "o", "Mid-term",
+                                                    use_cache=False) for i in range(n)], n
+
+# ---------------------------------
+# Ejecución
+# ---------------------------------
+_TMP = tempfile.mkdtemp(prefix="qrt_bench_")
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+
+def run_case(name: str, scale: dict, repeat: int) -> dict:
+    fn, n = CASES[name][1](scale)
+    if fn is None:
+        return {"skipped": True}
+    fn()                                      # calentamiento (imports, cachés de numpy...)
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    wall = statistics.median(times)
+    return {"wall_s": wall, "min_s": min(times), "items": n, "items_per_s": n / wall if wall else None,
+            "peak_mb": peak / 2**20}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline benchmarks for finance, risk, storage and export")
+    ap.add_argument("groups", nargs="*", default=GROUPS, help=f"any of {', '.join(GROUPS)} or case names")
+    ap.add_argument("--scale", choices=SCALES, default="small")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--baseline", help="compare against a previous --json file")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown")
+    a = ap.parse_args(argv)
+
+    names = [n for n, (g, _) in CASES.items() if g in a.groups or n in a.groups]
+    scale = SCALES[a.scale]
+    base = json.load(open(a.baseline)) if a.baseline else {}
+    base = base.get("cases", base)
+    res, regressions = {}, []
+    print(f"{'case':<32}{'items':>10}{'wall (ms)':>12}{'items/s':>14}{'peak MB':>10}{'vs base':>10}")
+    for name in names:
+        r = res[name] = run_case(name, scale, a.repeat)
+        if r.get("skipped"):
+            print(f"{name:<32}  skipped"); continue
+        delta = ""
+        if name in base and base[name].get("wall_s"):
+            rel = r["wall_s"] / base[name]["wall_s"] - 1
+            delta = f"{rel:+.0%}"
+            if rel > a.threshold:
+                regressions.append(name); delta += " !"
+        print(f"{name:<32}{r['items']:>10,}{r['wall_s']*1e3:>12.1f}{r['items_per_s']:>14,.0f}"
+              f"{r['peak_mb']:>10.1f}{delta:>10}", flush=True)
+    if a.json:
+        with open(a.json, "w") as f:
+            json.dump({"scale": a.scale, "python": sys.version.split()[0], "numpy": np.__version__,
+                       "pandas": pd.__version__, "cases": res}, f, indent=2)
+    if regressions:
+        print(f"Regressions beyond {a.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# bench_imports.py — coste de arranque en frío por módulo
+#
+#   python bench_imports.py                      # tabla por módulo
+#   python bench_imports.py --json base.json     # guarda una línea base
+#   python bench_imports.py --baseline base.json --threshold 0.25   # falla si empeora >25%
+#
+# Cada módulo se importa en un proceso nuevo (sin caché de sys.modules) y se repite
+# `--repeat` veces; se informa la mediana del tiempo de import y el acumulado que da
+# `python -X importtime` para el propio módulo.
+
+import argparse, json, os, re, statistics, subprocess, sys
+
+MODULES = ["streamlit", "pandas", "numpy", "matplotlib.pyplot", "openai",
+           "finance", "simulation", "visuals", "exporters", "storage", "llm_cache",
+           "llm_client", "ingest", "analysis", "advisory", "batch", "risk_analytics", "risk_matrix", "tracing",
+           "jobs"]
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def _import_once(module: str) -> dict:
+    code = ("import time; t=time.perf_counter(); import {m}; "
+            "print(time.perf_counter()-t)").format(m=module)
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-bench")}
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=HERE, env=env,
+                       capture_output=True, text=True)
+    if p.returncode != 0:
+        return {"error": p.stderr.strip().splitlines()[-1] if p.stderr.strip() else "failed"}
+    # línea del propio módulo en -X importtime: "import time: self | cumulative | name"
+    cum = None
+    for line in p.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|\s+(\S+)", line)
+        if m and m.group(3) == module:
+            cum = int(m.group(2)) / 1e6
+    return {"wall_s": float(p.stdout.strip().splitlines()[-1]), "importtime_s": cum}
+
+def bench(modules, repeat: int = 3) -> dict:
+    out = {}
+    for m in modules:
+        runs = [_import_once(m) for _ in range(repeat)]
+        if any("error" in r for r in runs):
+            out[m] = {"error": next(r["error"] for r in runs if "error" in r)}
+            continue
+        out[m] = {"wall_s": statistics.median(r["wall_s"] for r in runs),
+                  "importtime_s": statistics.median(r["importtime_s"] or 0.0 for r in runs)}
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Cold-start import cost per module")
+    ap.add_argument("modules", nargs="*", default=MODULES)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--baseline", help="compare against a previous --json file")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown")
+    a = ap.parse_args(argv)
+
+    res = bench(a.modules, a.repeat)
+    base = json.load(open(a.baseline)) if a.baseline else {}
+    regressions = []
+    print(f"{'module':<20}{'wall (ms)':>12}{'importtime (ms)':>18}{'vs base':>10}")
+    for m, r in sorted(res.items(), key=lambda kv: -kv[1].get("wall_s", 0)):
+        if "error" in r:
+            print(f"{m:<20}  ERROR: {r['error']}"); continue
+        delta = ""
+        if m in base and base[m].get("wall_s"):
+            rel = r["wall_s"] / base[m]["wall_s"] - 1
+            delta = f"{rel:+.0%}"
+            if rel > a.threshold:
+                regressions.append(m); delta += " !"
+        print(f"{m:<20}{r['wall_s']*1e3:>12.1f}{r['importtime_s']*1e3:>18.1f}{delta:>10}")
+    if a.json:
+        with open(a.json, "w") as f:
+            json.dump(res, f, indent=2)
+    if regressions:
+        print(f"Regressions beyond {a.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,80 +1,364 @@
-import io
-import pandas as pd
+# exporters.py — informes en Markdown/HTML/PDF/XLSX/DOCX/CSV
+#
+# Plantillas compiladas una vez al importar; los formatos pesados (PDF con wkhtmltopdf,
+# DOCX, XLSX) se generan en un pool de hilos en segundo plano y se cachean por hash del
+# resultado. export_zip() vuelca un rango de fechas del historial a un ZIP en streaming.
+#
+#   python exporters.py --from 2025-01-01 --to 2025-12-31 --formats md,pdf --out reports.zip
 
-def _df_to_markdown_safe(df: pd.DataFrame) -> str:
-    """Convierte un DataFrame a Markdown, incluso si falta 'tabulate'."""
-    try:
-        import tabulate  # noqa: F401
-        return df.to_markdown(index=False)
-    except Exception:
-        if df is None or df.empty:
-            return "_No data._"
-        header = " | ".join(df.columns.astype(str))
-        sep = " | ".join(["---"] * len(df.columns))
-        rows = [" | ".join(map(lambda x: str(x) if x is not None else "", r))
-                for r in df.astype(str).values.tolist()]
-        preview = "\n".join(rows[:200])
-        return f"{header}\n{sep}\n{preview}"
-
-def to_markdown_report(res: dict) -> str:
-    sw = res["swot"]
-    pestel_md = ""
-    if hasattr(res["pestel"], "iterrows"):
-        for _, row in res["pestel"].iterrows():
-            pts = row.get("points", [])
-            pts_md = "\n".join([f"- {p}" for p in pts]) if isinstance(pts, list) else str(pts)
-            pestel_md += f"### {row.get('factor','')}\n{pts_md}\n\n"
+import argparse, hashlib, io, json, os, sys, threading, zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
+import pandas as pd
+import tracing
 
-    risks_md = ""
-    if isinstance(res.get("risks"), pd.DataFrame):
-        risks_md = _df_to_markdown_safe(res["risks"])
+EXPORT_WORKERS = int(os.getenv("QRT_EXPORT_WORKERS", "4"))
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+MIME = {"md": "text/markdown", "html": "text/html", "pdf": "application/pdf", "csv": "text/csv",
+        "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"}
+SWOT_QUADRANTS = ["strengths", "weaknesses", "opportunities", "threats"]
+RISK_COLUMNS = ["category", "risk", "probability", "impact", "mitigation", "score", "priority"]
 
-    md = f"""# QRT Strategic Analysis
+# ---------------------------------
+# Plantillas (compiladas una vez)
+# ---------------------------------
+REPORT_MD = Template("""# QRT Strategic Analysis
 
 ## Executive Summary
-{res.get('executive_summary','')}
+$executive_summary
 
 ## PESTEL
-{pestel_md}
+$pestel
 
 ## SWOT
 **Strengths**
-- {chr(10).join(sw.get("strengths", []))}
+$strengths
 
 **Weaknesses**
-- {chr(10).join(sw.get("weaknesses", []))}
+$weaknesses
 
 **Opportunities**
-- {chr(10).join(sw.get("opportunities", []))}
+$opportunities
 
 **Threats**
-- {chr(10).join(sw.get("threats", []))}
+$threats
 
 ## Legal & Fiscal
-{res.get('legal_fiscal','')}
+$legal_fiscal
 
 ## Logistics & Infrastructure
-{res.get('logistics','')}
+$logistics
 
 ## Top Risks
-{risks_md}
+$risks
 
 ## Recommendations
-- {chr(10).join(res.get("recommendations", []))}
-"""
-    return md
+$recommendations
+""")
+PESTEL_MD = Template("### $factor\n$points\n\n")
+REPORT_HTML = Template("""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>QRT Strategic Analysis</title>
+<style>
+body { font-family: Helvetica, Arial, sans-serif; font-size: 11pt; margin: 2em; }
+h1 { color: #0b3d91; } h2 { border-bottom: 1px solid #ccc; padding-bottom: 2px; }
+table { border-collapse: collapse; width: 100%; font-size: 9pt; }
+th, td { border: 1px solid #ccc; padding: 4px; text-align: left; vertical-align: top; }
+th { background: #f0f3f8; }
+</style></head>
+<body>
+$body
+</body></html>
+""")
+
+def _df_to_markdown_safe(df: pd.DataFrame) -> str:
+    """Convierte un DataFrame a Markdown, incluso si falta 'tabulate'."""
+    try:
+        import tabulate  # noqa: F401
+        return df.to_markdown(index=False)
+    except Exception:
+        if df is None or df.empty:
+            return "_No data._"
+        header = " | ".join(df.columns.astype(str))
+        sep = " | ".join(["---"] * len(df.columns))
+        rows = [" | ".join(map(lambda x: str(x) if x is not None else "", r))
+                for r in df.astype(str).values.tolist()]
+        preview = "\n".join(rows[:200])
+        return f"{header}\n{sep}\n{preview}"
+
+def _bullets(items) -> str:
+    return "\n".join(f"- {x}" for x in items or [])
+
+def _pestel_rows(pestel):
+    if not isinstance(pestel, pd.DataFrame) or pestel.empty:
+        return []
+    factors = pestel["factor"] if "factor" in pestel.columns else [""] * len(pestel)
+    points = pestel["points"] if "points" in pestel.columns else [[]] * len(pestel)
+    return [(str(f), p if isinstance(p, list) else [p]) for f, p in zip(factors, points)]
+
+def to_markdown_report(res: dict) -> str:
+    sw = res.get("swot") or {}
+    risks = res.get("risks")
+    return REPORT_MD.substitute(
+        executive_summary=res.get("executive_summary", ""),
+        pestel="".join(PESTEL_MD.substitute(factor=f, points=_bullets(p)) for f, p in _pestel_rows(res.get("pestel"))),
+        **{q: _bullets(sw.get(q, [])) for q in SWOT_QUADRANTS},
+        legal_fiscal=res.get("legal_fiscal", ""), logistics=res.get("logistics", ""),
+        risks=_df_to_markdown_safe(risks) if isinstance(risks, pd.DataFrame) else "",
+        recommendations=_bullets(res.get("recommendations", [])))
 
 def risks_to_csv_bytes(df: pd.DataFrame) -> bytes:
     if not isinstance(df, pd.DataFrame) or df.empty:
-        df = pd.DataFrame(columns=["category","risk","probability","impact","mitigation","score","priority"])
+        df = pd.DataFrame(columns=RISK_COLUMNS)
     return df.to_csv(index=False).encode("utf-8")
 
+# ---------------------------------
+# HTML / PDF
+# ---------------------------------
+_local = threading.local()      # un conversor Markdown por hilo (no es thread-safe)
+_pdf_config = None              # configuración de pdfkit; False si no hay wkhtmltopdf
+_pdf_lock = threading.Lock()
+
+def markdown_to_html(md_text: str) -> str:
+    md = getattr(_local, "md", None)
+    if md is None:
+        from markdown import Markdown
+        md = _local.md = Markdown(extensions=["tables"])
+    return REPORT_HTML.substitute(body=md.reset().convert(md_text))
+
+def _pdfkit():
+    """(pdfkit, configuration) la primera vez; None si falta pdfkit o wkhtmltopdf."""
+    global _pdf_config
+    with _pdf_lock:
+        if _pdf_config is None:
+            try:
+                import pdfkit
+                _pdf_config = (pdfkit, pdfkit.configuration())
+            except Exception:
+                _pdf_config = False
+    return _pdf_config or None
+
+@tracing.traced("export.pdf")
 def markdown_to_pdf_bytes(md_text: str):
     """Convierte Markdown a PDF si pdfkit/wkhtmltopdf están disponibles."""
+    kit = _pdfkit()
+    if kit is None:
+        return None
+    pdfkit, config = kit
     try:
-        from markdown import markdown
-        import pdfkit  # requiere wkhtmltopdf
-        html = markdown(md_text)
-        return pdfkit.from_string(html, False)
+        return pdfkit.from_string(markdown_to_html(md_text), False, configuration=config,
+                                  options={"encoding": "UTF-8", "quiet": ""})
     except Exception:
         return None
+
+# ---------------------------------
+# XLSX / DOCX (dependencias opcionales: openpyxl, python-docx)
+# ---------------------------------
+def to_xlsx_bytes(res: dict):
+    sw = res.get("swot") or {}
+    sheets = {
+        "Summary": pd.DataFrame({"section": ["Executive Summary", "Legal & Fiscal", "Logistics & Infrastructure"],
+                                 "text": [res.get("executive_summary", ""), res.get("legal_fiscal", ""),
+                                          res.get("logistics", "")]}),
+        "PESTEL": pd.DataFrame([(f, p) for f, pts in _pestel_rows(res.get("pestel")) for p in pts],
+                               columns=["factor", "point"]),
+        "SWOT": pd.DataFrame([(q, x) for q in SWOT_QUADRANTS for x in sw.get(q, [])], columns=["quadrant", "item"]),
+        "Risks": res["risks"] if isinstance(res.get("risks"), pd.DataFrame) else pd.DataFrame(columns=RISK_COLUMNS),
+        "Recommendations": pd.DataFrame({"recommendation": res.get("recommendations", [])}),
+    }
+    buf = io.BytesIO()
+    try:
+        with pd.ExcelWriter(buf) as xw:
+            for name, df in sheets.items():
+                df.to_excel(xw, sheet_name=name, index=False)
+    except ImportError:
+        return None
+    return buf.getvalue()
+
+def to_docx_bytes(res: dict):
+    try:
+        from docx import Document
+    except ImportError:
+        return None
+    doc = Document()
+    doc.add_heading("QRT Strategic Analysis", 0)
+    doc.add_heading("Executive Summary", 1); doc.add_paragraph(res.get("executive_summary", ""))
+    doc.add_heading("PESTEL", 1)
+    for factor, pts in _pestel_rows(res.get("pestel")):
+        doc.add_heading(factor, 2)
+        for p in pts:
+            doc.add_paragraph(str(p), style="List Bullet")
+    doc.add_heading("SWOT", 1)
+    for q in SWOT_QUADRANTS:
+        doc.add_paragraph().add_run(q.capitalize()).bold = True
+        for x in (res.get("swot") or {}).get(q, []):
+            doc.add_paragraph(str(x), style="List Bullet")
+    doc.add_heading("Legal & Fiscal", 1); doc.add_paragraph(res.get("legal_fiscal", ""))
+    doc.add_heading("Logistics & Infrastructure", 1); doc.add_paragraph(res.get("logistics", ""))
+    risks = res.get("risks")
+    doc.add_heading("Top Risks", 1)
+    if isinstance(risks, pd.DataFrame) and not risks.empty:
+        cells = risks.astype(object).where(risks.notna(), "").astype(str)
+        table = doc.add_table(rows=1, cols=len(cells.columns), style="Table Grid")
+        for cell, col in zip(table.rows[0].cells, cells.columns):
+            cell.text = str(col)
+        for values in cells.itertuples(index=False):
+            for cell, v in zip(table.add_row().cells, values):
+                cell.text = v
+    doc.add_heading("Recommendations", 1)
+    for x in res.get("recommendations", []):
+        doc.add_paragraph(str(x), style="List Bullet")
+    buf = io.BytesIO(); doc.save(buf)
+    return buf.getvalue()
+
+# ---------------------------------
+# Render con caché por hash del resultado y pool en segundo plano
+# ---------------------------------
+RENDERERS = {
+    "md": lambda res: to_markdown_report(res).encode("utf-8"),
+    "html": lambda res: markdown_to_html(to_markdown_report(res)).encode("utf-8"),
+    "pdf": lambda res: markdown_to_pdf_bytes(to_markdown_report(res)),
+    "xlsx": to_xlsx_bytes,
+    "docx": to_docx_bytes,
+    "csv": lambda res: risks_to_csv_bytes(res.get("risks")),
+}
+
+_cache = OrderedDict()          # (result_hash, fmt) -> bytes | None  (LRU acotado por tamaño)
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+_executor = None
+
+def result_hash(res: dict) -> str:
+    """Hash estable del resultado (DataFrames vía to_json): clave de la caché de informes y de app."""
+    blob = json.dumps(res, sort_keys=True, default=lambda o: o.to_json() if hasattr(o, "to_json") else str(o))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def render(res: dict, fmt: str, key: str = None):
+    """Bytes del informe en `fmt` (None si falta la dependencia del formato). Cacheado."""
+    global _cache_bytes
+    ck = (key or result_hash(res), fmt)
+    with _cache_lock:
+        if ck in _cache:
+            _cache.move_to_end(ck)
+            tracing.event("export.render", fmt=fmt, cache_hit=True)
+            return _cache[ck]
+    with tracing.span("export.render", fmt=fmt, cache_hit=False):
+        data = RENDERERS[fmt](res)
+    with _cache_lock:
+        if ck not in _cache:
+            _cache[ck] = data; _cache_bytes += len(data or b"")
+            while _cache_bytes > CACHE_MAX_BYTES and len(_cache) > 1:
+                _, old = _cache.popitem(last=False); _cache_bytes -= len(old or b"")
+    return data
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _cache_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+    return _executor
+
+def submit(res: dict, fmt: str, key: str = None):
+    """Encola el render en segundo plano; devuelve un Future con los bytes."""
+    return _pool().submit(render, res, fmt, key or result_hash(res))
+
+def render_all(res: dict, formats=("md", "html", "pdf", "xlsx", "docx"), key: str = None) -> dict:
+    """{fmt: Future}: todos los formatos en paralelo."""
+    key = key or result_hash(res)
+    return {fmt: submit(res, fmt, key) for fmt in formats}
+
+# ---------------------------------
+# ZIP del historial en streaming
+# ---------------------------------
+class _Sink(io.RawIOBase):
+    """Destino no posicionable para ZipFile: acumula lo escrito hasta que se vacía."""
+    def __init__(self):
+        self.chunks = []
+    def writable(self):
+        return True
+    def write(self, b):
+        self.chunks.append(bytes(b)); return len(b)
+    def drain(self) -> bytes:
+        out = b"".join(self.chunks); self.chunks = []
+        return out
+
+def _iter_history(date_from=None, date_to=None, page_size=200):
+    import storage
+    cursor = None
+    while True:
+        df, cursor = storage.page_analyses(before_id=cursor, limit=page_size, date_from=date_from, date_to=date_to)
+        for aid, ts, country, tech in zip(df["id"], df["ts"], df["country"], df["technology"]):
+            yield int(aid), ts, country, tech
+        if cursor is None:
+            return
+
+def _entry_name(aid, ts, country, tech, fmt) -> str:
+    slug = "_".join(str(x).replace(" ", "-").replace("/", "-") for x in (country, tech) if x)
+    return f"{str(ts)[:10]}_{aid:06d}{'_' + slug if slug else ''}.{fmt}"
+
+def iter_zip(date_from=None, date_to=None, formats=("md", "csv"), window: int = None):
+    """Genera el ZIP por trozos de bytes: cada análisis se renderiza en el pool (con una
+    ventana de `window` en vuelo), se escribe y se suelta; nunca están todos en memoria."""
+    import storage
+    window = window or 2 * EXPORT_WORKERS
+    sink = _Sink()
+
+    def job(aid):
+        _, res = storage.load_result(aid)
+        return {fmt: RENDERERS[fmt](res) for fmt in formats}     # sin caché: son de un solo uso
+
+    index = []
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        pending = []
+        rows = _iter_history(date_from, date_to)
+        for row in rows:
+            pending.append((row, _pool().submit(job, row[0])))
+            if len(pending) < window:
+                continue
+            yield from _write_entry(zf, sink, index, *pending.pop(0))
+        for item in pending:
+            yield from _write_entry(zf, sink, index, *item)
+        zf.writestr("index.csv", pd.DataFrame(index, columns=["id", "ts", "country", "technology", "files"])
+                    .to_csv(index=False))
+    yield sink.drain()
+
+def _write_entry(zf, sink, index, row, fut):
+    aid, ts, country, tech = row
+    files = []
+    for fmt, data in fut.result().items():
+        if data:
+            name = _entry_name(aid, ts, country, tech, fmt)
+            zf.writestr(name, data); files.append(name)
+    index.append((aid, ts, country, tech, " ".join(files)))
+    yield sink.drain()
+
+def export_zip(out, date_from=None, date_to=None, formats=("md", "csv")) -> int:
+    """Escribe el ZIP en `out` (ruta o fichero binario). Devuelve los bytes escritos."""
+    f = open(out, "wb") if isinstance(out, str) else out
+    total = 0
+    try:
+        for chunk in iter_zip(date_from, date_to, formats):
+            f.write(chunk); total += len(chunk)
+    finally:
+        if isinstance(out, str):
+            f.close()
+    return total
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Export saved analyses to a ZIP")
+    ap.add_argument("--from", dest="date_from", help="YYYY-MM-DD (inclusive)")
+    ap.add_argument("--to", dest="date_to", help="YYYY-MM-DD (inclusive)")
+    ap.add_argument("--formats", default="md,csv", help=f"comma-separated: {','.join(RENDERERS)}")
+    ap.add_argument("--out", default="qrt_reports.zip")
+    a = ap.parse_args(argv)
+    formats = [f for f in a.formats.split(",") if f]
+    unknown = [f for f in formats if f not in RENDERERS]
+    if unknown:
+        ap.error(f"unknown format(s): {', '.join(unknown)}")
+    n = export_zip(a.out, a.date_from, a.date_to, formats)
+    print(f"{a.out}: {n:,} bytes", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
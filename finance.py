@@ -1,37 +1,360 @@
 import numpy as np
-import numpy_financial as npf
 import pandas as pd
+import tracing
 
-def lcoe(capex, opex_annual, energy_annual_mwh, years=25, discount=0.08):
-    cash_costs = [capex] + [opex_annual]*(years)
-    energy = [0] + [energy_annual_mwh]*(years)  # año 0 sin energía
-    # Valor presente de costes y energía
-    pvc = sum(c / ((1+discount)**t) for t, c in enumerate(cash_costs))
-    pve = sum(e / ((1+discount)**t) for t, e in enumerate(energy))
-    return pvc / max(pve, 1e-6)
+# Todas las funciones aceptan escalares o arrays NumPy (broadcast) y devuelven
+# escalares o arrays con la misma forma, para poder evaluar carteras enteras de una vez.
+
+# rejilla de tasas para localizar un bracket con cambio de signo del NPV
+IRR_GRID = np.array([-0.99, -0.75, -0.5, -0.25, -0.1, 0.0, 0.05, 0.1, 0.15, 0.2,
+                     0.3, 0.5, 0.75, 1.0, 2.0, 5.0, 10.0])
+IRR_TOL, IRR_MAXITER = 1e-10, 100
+
+def _out(x):
+    x = np.asarray(x)
+    return float(x) if x.ndim == 0 else x
+
+def annuity_factor(discount, years):
+    """Valor presente de 1 USD/año durante `years` años: (1 - (1+r)^-n) / r."""
+    r = np.asarray(discount, dtype=float)
+    n = np.asarray(years, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        af = (1 - (1 + r) ** -n) / r
+    return np.where(np.abs(r) < 1e-12, n, af)
+
+def _annuity_factor_deriv(discount, years):
+    """d(annuity_factor)/dr, usado por el Newton de la TIR."""
+    r = np.asarray(discount, dtype=float)
+    n = np.asarray(years, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d = (n * (1 + r) ** (-n - 1)) / r - (1 - (1 + r) ** -n) / r**2
+    return np.where(np.abs(r) < 1e-12, -n * (n + 1) / 2, d)
+
+def growing_annuity_factor(discount, years, growth=0.0):
+    """Valor presente de (1+g)^(t-1) USD en los años t=1..n (g<0: degradación)."""
+    g = np.asarray(growth, dtype=float)
+    r_eff = (1 + np.asarray(discount, dtype=float)) / (1 + g) - 1
+    return annuity_factor(r_eff, years) / (1 + g)
+
+def _growing_annuity_factor_deriv(discount, years, growth=0.0):
+    g = np.asarray(growth, dtype=float)
+    r_eff = (1 + np.asarray(discount, dtype=float)) / (1 + g) - 1
+    return _annuity_factor_deriv(r_eff, years) / (1 + g) ** 2
+
+def lcoe(capex, opex_annual, energy_annual_mwh, years=25, discount=0.08, degradation=0.0):
+    # año 0: solo capex; años 1..n: opex constante y energía con degradación -> anualidades
+    af = annuity_factor(discount, years)
+    pvc = np.asarray(capex, dtype=float) + np.asarray(opex_annual, dtype=float) * af
+    pve = np.asarray(energy_annual_mwh, dtype=float) * growing_annuity_factor(discount, years, -np.asarray(degradation))
+    return _out(pvc / np.maximum(pve, 1e-6))
+
+def _solve_irr(npv_fn, n):
+    """Newton con salvaguarda de bisección, vectorizado sobre `n` proyectos.
+
+    `npv_fn(r, idx)` devuelve (npv, dnpv/dr) de los proyectos `idx` a las tasas `r`.
+    Solo se itera sobre los proyectos aún no convergidos. Los que no tienen cambio de
+    signo en IRR_GRID devuelven NaN (como npf.irr).
+    """
+    all_idx = np.arange(n)
+    # bracket: de los intervalos de la rejilla con cambio de signo, el más cercano a 0
+    with np.errstate(over="ignore", invalid="ignore"):
+        f_grid = np.stack([npv_fn(np.full(n, g), all_idx)[0] for g in IRR_GRID], axis=-1)
+    change = np.isfinite(f_grid[:, :-1]) & np.isfinite(f_grid[:, 1:]) & \
+        (np.sign(f_grid[:, :-1]) != np.sign(f_grid[:, 1:]))
+    mid = np.abs((IRR_GRID[:-1] + IRR_GRID[1:]) / 2)
+    k = np.where(change, mid, np.inf).argmin(-1)
+    out = np.full(n, np.nan)
+    idx = all_idx[change.any(-1)]; k = k[idx]
+    lo = IRR_GRID[k]; hi = IRR_GRID[k + 1]; f_lo = f_grid[idx, k]
+    r = (lo + hi) / 2
+    for _ in range(IRR_MAXITER):
+        if idx.size == 0:
+            break
+        f, df = npv_fn(r, idx)
+        # estrechar el bracket según el signo del NPV
+        same_as_lo = np.sign(f) == np.sign(f_lo)
+        lo = np.where(same_as_lo, r, lo); f_lo = np.where(same_as_lo, f, f_lo)
+        hi = np.where(same_as_lo, hi, r)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            step = r - f / df
+        inside = np.isfinite(step) & (step > np.minimum(lo, hi)) & (step < np.maximum(lo, hi))
+        r_new = np.where(inside, step, (lo + hi) / 2)
+        done = np.abs(r_new - r) < IRR_TOL
+        out[idx[done]] = r_new[done]
+        keep = ~done
+        idx, r, lo, hi, f_lo = idx[keep], r_new[keep], lo[keep], hi[keep], f_lo[keep]
+    out[idx] = r
+    return out
 
 def irr_from_cashflows(capex, cashflows_years):
-    return float(npf.irr([-capex] + cashflows_years))
+    """TIR de [-capex] + cashflows. `cashflows_years` puede ser una lista (un proyecto)
+    o una matriz (proyectos x años); `capex` escalar o array por proyecto."""
+    cfs = np.asarray(cashflows_years, dtype=float)
+    capex = np.asarray(capex, dtype=float)
+    lead = np.broadcast_shapes(cfs.shape[:-1], capex.shape)
+    flows = np.concatenate([-np.broadcast_to(capex, lead)[..., None],
+                            np.broadcast_to(cfs, lead + cfs.shape[-1:])], axis=-1)
+    flows = flows.reshape(-1, flows.shape[-1])
+    t = np.arange(flows.shape[-1], dtype=float)
+
+    def npv_fn(r, idx):
+        v = (1 + r)[:, None] ** -t
+        fl = flows[idx]
+        return (fl * v).sum(-1), (-t * fl * v / (1 + r)[:, None]).sum(-1)
+
+    return _out(_solve_irr(npv_fn, flows.shape[0]).reshape(lead))
+
+def irr_degrading(capex, revenue_y1, opex, years=25, degradation=0.0):
+    """TIR con ingresos que decaen un `degradation` anual (revenue_y1 * (1-d)^(t-1))
+    y opex constante, sin materializar la serie de cashflows."""
+    shape = np.broadcast_shapes(*(np.shape(x) for x in (capex, revenue_y1, opex, years, degradation)))
+    capex, rev, opex, n, g = (a.ravel() for a in np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in (capex, revenue_y1, opex, years, degradation))))
+    g = -g
+
+    def npv_fn(r, idx):
+        return (-capex[idx] + rev[idx] * growing_annuity_factor(r, n[idx], g[idx])
+                - opex[idx] * annuity_factor(r, n[idx]),
+                rev[idx] * _growing_annuity_factor_deriv(r, n[idx], g[idx])
+                - opex[idx] * _annuity_factor_deriv(r, n[idx]))
+
+    return _out(_solve_irr(npv_fn, capex.size).reshape(shape))
+
+def irr_annuity(capex, cashflow_annual, years=25):
+    """TIR de un cashflow constante durante `years` años, sin materializar la serie."""
+    return irr_degrading(capex, cashflow_annual, 0.0, years)
 
 def payback_year(capex, cashflows_years):
-    cum = 0.0
-    for i, cf in enumerate(cashflows_years, start=1):
-        cum += cf
-        if cum >= capex:
-            return i
-    return None
-
-def quick_scenarios(capex, opex, tariff_usd_mwh, energy_mwh, years=25):
-    # cashflow simple: ingresos - opex
-    revenue = tariff_usd_mwh * energy_mwh
-    cf = [revenue - opex] * years
-    irr = irr_from_cashflows(capex, cf)
-    lcoe_val = lcoe(capex, opex, energy_mwh, years)
-    return {"IRR": irr, "LCOE": lcoe_val, "AnnualCashflow": revenue - opex}
+    """Primer año con cashflow acumulado >= capex. Escalar: int o None; array: float con NaN."""
+    cfs = np.asarray(cashflows_years, dtype=float)
+    capex = np.asarray(capex, dtype=float)
+    if cfs.size == 0:
+        return None if capex.ndim == 0 else np.full(capex.shape, np.nan)
+    reached = np.cumsum(cfs, axis=-1) >= capex[..., None]
+    year = np.where(reached.any(-1), reached.argmax(-1) + 1.0, np.nan)
+    if year.ndim == 0:
+        return None if np.isnan(year) else int(year)
+    return year
+
+def payback_annuity(capex, cashflow_annual, years=25):
+    """Payback de un cashflow constante: ceil(capex / cf), NaN si no se alcanza en `years`."""
+    capex = np.asarray(capex, dtype=float); cf = np.asarray(cashflow_annual, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        yr = np.maximum(np.ceil(capex / cf), 1.0)
+    return _out(np.where((cf > 0) & (yr <= years), yr, np.nan))
+
+def payback_degrading(capex, revenue_y1, opex, years=25, degradation=0.0):
+    """Payback con ingresos degradados; construye la serie año a año (proyectos x años)."""
+    t = np.arange(int(np.max(years)), dtype=float)
+    rev = np.asarray(revenue_y1, dtype=float)[..., None]
+    d = np.asarray(degradation, dtype=float)[..., None]
+    cf = rev * (1 - d) ** t - np.asarray(opex, dtype=float)[..., None]
+    cf = np.where(t < np.asarray(years, dtype=float)[..., None], cf, 0.0)
+    yr = payback_year(capex, cf)
+    return np.nan if yr is None else _out(yr)
+
+def quick_scenarios(capex, opex, tariff_usd_mwh, energy_mwh, years=25, discount=0.08, degradation=0.0):
+    # cashflow simple: ingresos (con degradación opcional) - opex, vectorizado sobre todos los argumentos
+    revenue = np.asarray(tariff_usd_mwh, dtype=float) * np.asarray(energy_mwh, dtype=float)
+    cf = revenue - np.asarray(opex, dtype=float)
+    if np.any(np.asarray(degradation) != 0):
+        payback = payback_degrading(capex, revenue, opex, years, degradation)
+    else:
+        payback = payback_annuity(capex, cf, years)
+    return {
+        "IRR": irr_degrading(capex, revenue, opex, years, degradation),
+        "LCOE": lcoe(capex, opex, energy_mwh, years, discount, degradation),
+        "AnnualCashflow": _out(cf),
+        "Payback": payback,
+    }
 
 def sensitivity_tariff(capex, opex, energy_mwh, tariffs):
+    tariffs = np.asarray(tariffs, dtype=float)
+    res = quick_scenarios(capex, opex, tariffs, energy_mwh)
+    return pd.DataFrame({"Tariff": tariffs, "IRR": res["IRR"], "AnnualCF": res["AnnualCashflow"]})
+
+# ---------------------------------
+# Sensibilidad N-dimensional y tornado
+# ---------------------------------
+GRID_VARS = ["Tariff", "CapEx", "OpEx", "Energy", "Discount"]
+GRID_MAX_CELLS = 500_000   # celdas evaluadas por bloque
+
+@tracing.traced("finance.sensitivity_grid")
+def sensitivity_grid(base: dict, ranges: dict, years=25, max_cells=GRID_MAX_CELLS) -> pd.DataFrame:
+    """Evalúa quick_scenarios sobre el producto cartesiano de `ranges` (var -> valores).
+
+    `base` da el caso base de cada variable de GRID_VARS; el valor base se añade a
+    cada eje para que el tornado salga del mismo grid. Devuelve un DataFrame tidy
+    (una fila por celda); si el grid supera `max_cells` se evalúa por bloques.
+    """
+    axes = [np.unique(np.append(np.asarray(ranges.get(v, []), dtype=float), base[v]))
+            for v in GRID_VARS]
+    shape = tuple(len(a) for a in axes)
+    total = int(np.prod(shape))
+    cols = {c: np.empty(total) for c in GRID_VARS + ["IRR", "LCOE", "AnnualCF", "Payback"]}
+    for start in range(0, total, max_cells):
+        sl = slice(start, min(start + max_cells, total))
+        idx = np.unravel_index(np.arange(sl.start, sl.stop), shape)
+        vals = {v: a[i] for v, a, i in zip(GRID_VARS, axes, idx)}
+        res = quick_scenarios(vals["CapEx"], vals["OpEx"], vals["Tariff"], vals["Energy"],
+                              years, vals["Discount"])
+        for v in GRID_VARS:
+            cols[v][sl] = vals[v]
+        cols["IRR"][sl] = res["IRR"]; cols["LCOE"][sl] = res["LCOE"]
+        cols["AnnualCF"][sl] = res["AnnualCashflow"]; cols["Payback"][sl] = res["Payback"]
+    return pd.DataFrame(cols)
+
+def grid_slice(grid: pd.DataFrame, base: dict, free=()) -> pd.DataFrame:
+    """Filas del grid con todas las variables en su valor base salvo las de `free`."""
+    mask = np.ones(len(grid), dtype=bool)
+    for v in GRID_VARS:
+        if v not in free:
+            mask &= np.isclose(grid[v].to_numpy(), base[v])
+    return grid[mask]
+
+def tornado(grid: pd.DataFrame, base: dict, metric="IRR") -> pd.DataFrame:
+    """Swing de `metric` al mover cada variable a su mínimo/máximo con el resto en base."""
+    base_val = grid_slice(grid, base)[metric].iloc[0]
     rows = []
-    for t in tariffs:
-        res = quick_scenarios(capex, opex, t, energy_mwh)
-        rows.append({"Tariff": t, "IRR": res["IRR"], "AnnualCF": res["AnnualCashflow"]})
-    return pd.DataFrame(rows)
+    for v in GRID_VARS:
+        s = grid_slice(grid, base, free=(v,)).sort_values(v)
+        if len(s) < 2:
+            continue
+        lo, hi = s.iloc[0], s.iloc[-1]
+        rows.append({"Variable": v, "Low": lo[v], "High": hi[v], "Base": base_val,
+                     f"{metric}@Low": lo[metric], f"{metric}@High": hi[metric],
+                     "Swing": abs(hi[metric] - lo[metric])})
+    return pd.DataFrame(rows).sort_values("Swing", ascending=False).reset_index(drop=True)
+
+# ---------------------------------
+# Modelo de cashflow anual: degradación, escalados, deuda esculpida e impuestos
+# ---------------------------------
+CASHFLOW_DEFAULTS = {
+    "years": 25, "discount": 0.08, "degradation": 0.005,
+    "tariff_escalation": 0.0, "opex_escalation": 0.02,
+    "augmentation_capex": 0.0, "augmentation_every": 0,     # BESS: recompra de capacidad cada k años
+    "gearing": 0.70, "debt_rate": 0.065, "debt_tenor": 15, "target_dscr": 1.30,
+    "depreciation_years": 20, "tax_rate": 0.25,
+}
+CASHFLOW_COLUMNS = ["energy", "tariff", "revenue", "opex", "augmentation", "ebitda", "depreciation", "interest",
+                    "principal", "debt_service", "debt_balance", "tax", "cfads", "dscr", "project_cf", "equity_cf"]
+TAX_ITERATIONS = 4          # pasadas del punto fijo impuestos <-> intereses de la deuda esculpida
+
+def _cum_tax(taxable, rate):
+    """Impuesto anual con compensación ilimitada de pérdidas: se tributa cuando el
+    acumulado de bases supera su máximo anterior (sin bucle año a año)."""
+    paid_base = np.maximum(np.maximum.accumulate(np.cumsum(taxable, axis=-1), axis=-1), 0.0)
+    return rate * np.diff(paid_base, axis=-1, prepend=0.0)
+
+@tracing.traced("finance.cashflow_model")
+def cashflow_model(capex, opex, tariff_usd_mwh, energy_mwh, detail: bool = True, **assumptions):
+    """Cashflow año a año de una cartera de escenarios en una sola pasada.
+
+    Todos los argumentos (y los de CASHFLOW_DEFAULTS en `assumptions`) admiten escalares
+    o arrays con broadcast; cada combinación es un escenario. Año t = 1..years:
+
+    - energía con degradación anual; con `augmentation_every` = k, cada k años se paga
+      `augmentation_capex` (escalado con el opex) y la capacidad vuelve a la nominal;
+    - tarifa y opex escalados; EBITDA = ingresos - opex;
+    - deuda esculpida: servicio = CFADS / target_dscr durante `debt_tenor`, importe = su
+      valor actual a `debt_rate`, con tope `gearing` × capex (si el tope manda, el perfil
+      se escala y el DSCR sube);
+    - amortización lineal del capex (y de cada aumento en k años) e impuesto de sociedades
+      con compensación de pérdidas; el escudo fiscal de los intereses se resuelve con
+      TAX_ITERATIONS pasadas.
+
+    Devuelve (summary, table): summary con ProjectIRR/EquityIRR (post-impuestos), NPV a
+    `discount`, MinDSCR, Debt y EquityPayback por escenario; table en formato largo
+    (escenario × año, columnas CASHFLOW_COLUMNS) o None si `detail=False`.
+    """
+    unknown = set(assumptions) - set(CASHFLOW_DEFAULTS)
+    if unknown:
+        raise TypeError(f"unknown assumptions: {', '.join(sorted(unknown))}")
+    a = {**CASHFLOW_DEFAULTS, **assumptions, "capex": capex, "opex": opex, "tariff": tariff_usd_mwh,
+         "energy": energy_mwh}
+    keys = list(a)
+    arrs = np.broadcast_arrays(*(np.asarray(a[k], dtype=float) for k in keys))
+    p = {k: v.reshape(-1, 1) for k, v in zip(keys, arrs)}        # escenarios x 1
+    n_sc = arrs[0].size
+    T = int(np.max(p["years"]))
+    t = np.arange(1, T + 1, dtype=float)                          # 1 x años
+    live = t <= p["years"]
+
+    # operación
+    k = np.maximum(p["augmentation_every"], 0)
+    has_aug = k > 0
+    age = np.where(has_aug, np.mod(t - 1, np.where(has_aug, k, 1)), t - 1)
+    energy = p["energy"] * (1 - p["degradation"]) ** age * live
+    opex_idx = (1 + p["opex_escalation"]) ** (t - 1)
+    price = p["tariff"] * (1 + p["tariff_escalation"]) ** (t - 1)
+    revenue = energy * price
+    opex_t = p["opex"] * opex_idx * live
+    aug_year = has_aug & (np.mod(t, np.where(has_aug, k, 1)) == 0) & (t < p["years"])
+    augmentation = np.where(aug_year, p["augmentation_capex"] * opex_idx, 0.0)
+    ebitda = revenue - opex_t
+
+    # amortización: capex lineal + cada aumento en k años
+    dep_years = np.maximum(p["depreciation_years"], 1)
+    depreciation = np.where(t <= dep_years, p["capex"] / dep_years, 0.0)
+    cum_aug = np.cumsum(augmentation, axis=1)
+    lag = np.where(has_aug, k, 1).astype(int)
+    cols = np.arange(T)[None, :] - lag                            # índice del año t-k (0-based)
+    cum_aug_lag = np.where(cols >= 0, np.take_along_axis(cum_aug, np.clip(cols, 0, None), axis=1), 0.0)
+    prev = np.concatenate([np.zeros((n_sc, 1)), cum_aug[:, :-1]], axis=1)
+    prev_lag = np.concatenate([np.zeros((n_sc, 1)), cum_aug_lag[:, :-1]], axis=1)
+    depreciation = (depreciation + (prev - prev_lag) / np.where(has_aug, k, 1)) * live
+
+    # proyecto (sin apalancar): impuesto sin escudo de intereses
+    tax_unlev = _cum_tax(ebitda - depreciation, p["tax_rate"]) * live
+    project_cf = (ebitda - augmentation - tax_unlev) * live
+
+    # deuda esculpida + punto fijo con el impuesto apalancado
+    tenor = (t <= p["debt_tenor"]) & live
+    v = (1 + p["debt_rate"]) ** -t
+    tax = tax_unlev
+    for _ in range(TAX_ITERATIONS):
+        cfads = ebitda - augmentation - tax
+        ds_cap = np.where(tenor, np.maximum(cfads, 0.0) / p["target_dscr"], 0.0)
+        capacity = (ds_cap * v).sum(axis=1, keepdims=True)
+        debt = np.minimum(p["gearing"] * p["capex"], capacity)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.where(capacity > 0, debt / capacity, 0.0)
+        debt_service = ds_cap * scale
+        # saldo al cierre de t = valor actual del servicio restante
+        remaining = np.cumsum((debt_service * v)[:, ::-1], axis=1)[:, ::-1] - debt_service * v
+        balance = remaining / v
+        opening = np.concatenate([debt, balance[:, :-1]], axis=1)
+        interest = opening * p["debt_rate"] * tenor
+        tax = _cum_tax(ebitda - depreciation - interest, p["tax_rate"]) * live
+    principal = debt_service - interest
+    cfads = (ebitda - augmentation - tax) * live
+    equity_cf = cfads - debt_service
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dscr = np.where(debt_service > 0, cfads / debt_service, np.nan)
+
+    # métricas por escenario
+    equity0 = p["capex"][:, 0] - debt[:, 0]
+    disc = (1 + p["discount"]) ** -t
+    with np.errstate(all="ignore"):
+        min_dscr = np.where(np.isfinite(dscr).any(1), np.nanmin(np.where(np.isfinite(dscr), dscr, np.inf), 1),
+                            np.nan)
+    summary = pd.DataFrame({
+        "CapEx": p["capex"][:, 0], "Tariff": p["tariff"][:, 0], "Energy": p["energy"][:, 0],
+        "Debt": debt[:, 0], "Equity": equity0,
+        "ProjectIRR": irr_from_cashflows(p["capex"][:, 0], project_cf),
+        "EquityIRR": irr_from_cashflows(equity0, equity_cf),
+        "ProjectNPV": (project_cf * disc).sum(1) - p["capex"][:, 0],
+        "EquityNPV": (equity_cf * disc).sum(1) - equity0,
+        "MinDSCR": min_dscr,
+        "EquityPayback": payback_year(equity0, equity_cf),
+    })
+    summary.insert(0, "scenario", np.arange(n_sc))
+    if not detail:
+        return summary, None
+    series = {"energy": energy, "tariff": price * live, "revenue": revenue, "opex": opex_t,
+              "augmentation": augmentation, "ebitda": ebitda, "depreciation": depreciation, "interest": interest,
+              "principal": principal, "debt_service": debt_service, "debt_balance": balance * tenor,
+              "tax": tax, "cfads": cfads, "dscr": dscr, "project_cf": project_cf, "equity_cf": equity_cf}
+    table = pd.DataFrame({"scenario": np.repeat(np.arange(n_sc), T), "year": np.tile(t.astype(int), n_sc),
+                          **{c: np.broadcast_to(series[c], (n_sc, T)).ravel() for c in CASHFLOW_COLUMNS}})
+    return summary, table[live.ravel()].reset_index(drop=True)
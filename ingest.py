@@ -0,0 +1,166 @@
+# ingest.py — anexos: extracción de texto en streaming, troceado y selección BM25 (local)
+
+import csv, io, math, re, zipfile
+from collections import Counter
+from xml.etree.ElementTree import iterparse
+
+CHUNK_CHARS = 1200          # tamaño objetivo de cada trozo
+CHUNK_OVERLAP = 150
+MAX_CHARS_PER_FILE = 2_000_000   # tope de texto extraído por anexo (memoria acotada)
+TOKEN_BUDGET = 3000         # tokens totales de anexos en el prompt
+CHARS_PER_TOKEN = 4
+
+# términos del dominio que siempre cuentan para la relevancia
+DOMAIN_TERMS = ("tariff ppa permit licence license tax vat duty incentive grid interconnection "
+                "port customs logistics land environmental eia risk capex opex irradiation wind "
+                "storage battery regulation offtaker")
+_STOP = set("the and for with that this from are was were has have not but its into per via "
+            "los las del que por con una para".split())
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# ---------------------------------
+# Extracción (generadores de bloques de texto)
+# ---------------------------------
+def _as_stream(content):
+    if isinstance(content, (bytes, bytearray)):
+        return io.BytesIO(content)
+    if isinstance(content, str):
+        return io.BytesIO(content.encode("utf-8"))
+    content.seek(0)
+    return content
+
+def _iter_txt(stream):
+    text = io.TextIOWrapper(stream, encoding="utf-8", errors="ignore")
+    try:
+        for line in text:
+            # descarta líneas de binario (p.ej. un .doc antiguo subido como texto)
+            if sum(ch.isprintable() or ch.isspace() for ch in line) >= 0.85 * len(line):
+                yield line
+    finally:
+        text.detach()       # el stream es del llamador: el wrapper no debe cerrarlo
+
+def _iter_csv(stream, rows_per_block=20):
+    text = io.TextIOWrapper(stream, encoding="utf-8", errors="ignore", newline="")
+    try:
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if header is None:
+            return
+        block = []
+        for row in reader:
+            # cada fila como "col: valor; ..." para que el texto sea autoexplicativo
+            block.append("; ".join(f"{h}: {v}" for h, v in zip(header, row) if v))
+            if len(block) >= rows_per_block:
+                yield "\n".join(block) + "\n"; block = []
+        if block:
+            yield "\n".join(block) + "\n"
+    finally:
+        text.detach()
+
+def _iter_docx(stream):
+    with zipfile.ZipFile(stream) as z, z.open("word/document.xml") as xml:
+        parts = []
+        for event, el in iterparse(xml, events=("end",)):
+            if el.tag == _W_NS + "t" and el.text:
+                parts.append(el.text)
+            elif el.tag == _W_NS + "p":
+                if parts:
+                    yield "".join(parts) + "\n"; parts = []
+                el.clear()
+
+def _iter_pdf(stream):
+    try:
+        from pypdf import PdfReader
+    except Exception:
+        yield "[PDF text extraction unavailable: install pypdf]"
+        return
+    for page in PdfReader(stream).pages:
+        yield (page.extract_text() or "") + "\n"
+
+def iter_text(name: str, content):
+    """Genera bloques de texto del anexo según su extensión."""
+    ext = name.lower().rsplit(".", 1)[-1] if "." in name else ""
+    stream = _as_stream(content)
+    reader = {"pdf": _iter_pdf, "docx": _iter_docx, "csv": _iter_csv}.get(ext, _iter_txt)
+    total = 0
+    try:
+        for block in reader(stream):
+            total += len(block)
+            yield block
+            if total >= MAX_CHARS_PER_FILE:
+                break
+    except Exception as e:
+        yield f"[Could not extract text from {name}: {e}]"
+
+def chunk_blocks(blocks, size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP):
+    """Agrupa bloques en trozos de ~`size` caracteres con solape, cortando en espacios."""
+    buf = ""
+    for block in blocks:
+        buf += block
+        while len(buf) >= size:
+            cut = buf.rfind(" ", size // 2, size)
+            cut = cut if cut > 0 else size
+            chunk = buf[:cut].strip()
+            if chunk:
+                yield chunk
+            buf = buf[max(cut - overlap, 0):]
+    if buf.strip():
+        yield buf.strip()
+
+# ---------------------------------
+# Índice BM25
+# ---------------------------------
+def tokenize(text: str) -> list:
+    return [w for w in re.findall(r"\w+", text.lower()) if len(w) > 2 and w not in _STOP]
+
+class BM25Index:
+    """Índice BM25 en memoria: se construye una vez y se consulta muchas veces."""
+    def __init__(self, docs: list, k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.tfs = [Counter(tokenize(d)) for d in docs]
+        self.lens = [sum(tf.values()) for tf in self.tfs]
+        self.avg = (sum(self.lens) / len(self.lens) if self.lens else 0.0) or 1.0
+        self.df = Counter(t for tf in self.tfs for t in tf)
+
+    def scores(self, query) -> list:
+        """Puntuación de cada documento; `query` es texto o {término: peso}."""
+        n, k1, b = len(self.tfs), self.k1, self.b
+        q = query if isinstance(query, dict) else dict.fromkeys(tokenize(query), 1.0)
+        idf = {t: w * math.log(1 + (n - self.df[t] + 0.5) / (self.df[t] + 0.5)) for t, w in q.items() if self.df[t]}
+        return [sum(idf[t] * tf[t] * (k1 + 1) / (tf[t] + k1 * (1 - b + b * ln / self.avg))
+                    for t in idf if t in tf)
+                for tf, ln in zip(self.tfs, self.lens)]
+
+def bm25_scores(docs: list, query, k1: float = 1.5, b: float = 0.75) -> list:
+    """Puntuación BM25 de cada documento; `query` es texto o {término: peso}."""
+    return BM25Index(docs, k1, b).scores(query) if docs else []
+
+def select_chunks(attachments: dict, query: str, token_budget: int = TOKEN_BUDGET) -> str:
+    """Extrae, trocea y elige los trozos más relevantes para `query` dentro del presupuesto.
+
+    Devuelve el texto listo para el prompt, con los trozos elegidos en su orden original.
+    """
+    chunks = [(name, i, c) for name, content in (attachments or {}).items()
+              for i, c in enumerate(chunk_blocks(iter_text(name, content)))]
+    if not chunks:
+        return ""
+    # los términos del proyecto pesan el doble que los genéricos del dominio
+    weights = dict.fromkeys(tokenize(DOMAIN_TERMS), 1.0) | dict.fromkeys(tokenize(query), 2.0)
+    scores = bm25_scores([c for _, _, c in chunks], weights)
+    ranked = sorted(range(len(chunks)), key=lambda k: (-scores[k], k))
+    # primero el mejor trozo de cada anexo, luego el resto por puntuación
+    best = {}
+    for k in ranked:
+        best.setdefault(chunks[k][0], k)
+    budget = token_budget * CHARS_PER_TOKEN
+    picked = set()
+    for k in list(best.values()) + ranked:
+        size = len(chunks[k][2])
+        if k not in picked and size <= budget:
+            picked.add(k); budget -= size
+    totals = Counter(name for name, _, _ in chunks)
+    out = ""
+    for k in sorted(picked):
+        name, i, c = chunks[k]
+        out += f"\n\n### Attachment: {name} (excerpt {i + 1}/{totals[name]})\n{c}"
+    return out
@@ -0,0 +1,236 @@
+# jobs.py — cola local de análisis en SQLite con pool de workers
+#
+#   job_id = jobs.submit(params, kwargs)        # deduplica peticiones idénticas en curso
+#   jobs.status(job_id)                         # {"status": queued|running|done|error, "analysis_id", ...}
+#
+#   python jobs.py --workers 4                  # pool de workers en un proceso aparte
+#   python jobs.py --list                       # últimos trabajos
+#
+# La app arranca sus propios hilos worker (QRT_JOB_WORKERS, 0 = solo procesos externos).
+# El resultado se guarda en storage y el trabajo apunta a él con analysis_id, así que
+# sobrevive a un refresco del navegador o a un reinicio del servidor.
+
+import argparse, hashlib, json, os, socket, sqlite3, sys, threading, time, uuid
+import pandas as pd
+import storage, tracing
+
+JOB_WORKERS = int(os.getenv("QRT_JOB_WORKERS", "4"))
+POLL_S = 0.5                # espera de un worker ocioso entre consultas a la cola
+HEARTBEAT_S = 15            # el worker marca sus trabajos "running" como vivos cada tanto
+STALE_S = 8 * HEARTBEAT_S   # sin latido en este tiempo, el trabajo se da por perdido (worker caído)
+MAX_ATTEMPTS = 2
+ACTIVE = ("queued", "running")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs(
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    params TEXT,
+    payload TEXT,
+    created REAL, started REAL, finished REAL, heartbeat REAL,
+    worker TEXT,
+    attempts INTEGER DEFAULT 0,
+    analysis_id INTEGER,
+    error TEXT
+);
+-- a lo sumo un trabajo en curso por petición: la base de la deduplicación
+CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_active_key ON jobs(key) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS ix_jobs_status_created ON jobs(status, created);
+"""
+
+_ready = set()
+_wake = threading.Event()
+_workers = []
+_workers_lock = threading.Lock()
+
+def _path() -> str:
+    return os.path.join(os.path.dirname(storage.DB_PATH), "qrt_jobs.db")
+
+def _connect():
+    path = _path()
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if path not in _ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        if "heartbeat" not in {r[1] for r in conn.execute("PRAGMA table_info(jobs)")}:
+            conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+        _ready.add(path)
+    return conn
+
+def job_key(payload: dict) -> str:
+    """Hash de la petición completa (proyecto, contexto, anexos y opciones)."""
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+# ---------------------------------
+# Envío y consulta
+# ---------------------------------
+def submit(params: dict, kwargs: dict) -> str:
+    """Encola run_strategic_analysis(**kwargs) y devuelve el id del trabajo.
+
+    Si ya hay un trabajo idéntico en cola o ejecutándose, devuelve ese id en vez de
+    lanzar otra llamada al LLM. Los anexos (ficheros) se reducen aquí a los trozos
+    relevantes en texto, para que el trabajo sea JSON puro.
+    """
+    payload = dict(kwargs)
+    if not isinstance(payload.get("attachments"), str):
+        from ingest import select_chunks
+        payload["attachments"] = select_chunks(payload.get("attachments"),
+                                               f"{payload.get('country')} {payload.get('technology')} "
+                                               f"{payload.get('user_context') or ''}")
+    key = job_key(payload)
+    job_id = uuid.uuid4().hex
+    conn = _connect()
+    try:
+        conn.execute("""INSERT INTO jobs(id, key, params, payload, created) VALUES (?,?,?,?,?)
+                        ON CONFLICT(key) WHERE status IN ('queued', 'running') DO NOTHING""",
+                     (job_id, key, json.dumps(params, default=str), json.dumps(payload, default=str), time.time()))
+        row = conn.execute("SELECT id FROM jobs WHERE key=? AND status IN ('queued', 'running')", (key,)).fetchone()
+    finally:
+        conn.close()
+    tracing.event("job.submit", dedup=bool(row and row[0] != job_id))
+    _wake.set()
+    return row[0] if row else job_id
+
+def status(job_id: str) -> dict:
+    """Estado del trabajo (None si no existe), con posición en cola y segundos transcurridos."""
+    conn = _connect()
+    try:
+        row = conn.execute("""SELECT status, created, started, finished, analysis_id, error, attempts, params
+                              FROM jobs WHERE id=?""", (job_id,)).fetchone()
+        if row is None:
+            return None
+        st, created, started, finished, analysis_id, error, attempts, params = row
+        ahead = conn.execute("SELECT COUNT(*) FROM jobs WHERE status='queued' AND created < ?",
+                             (created,)).fetchone()[0] if st == "queued" else 0
+    finally:
+        conn.close()
+    return {"id": job_id, "status": st, "analysis_id": analysis_id, "error": error, "attempts": attempts,
+            "queue_position": ahead, "params": json.loads(params) if params else {},
+            "elapsed_s": (finished or time.time()) - (started or created)}
+
+def list_jobs(limit: int = 50) -> pd.DataFrame:
+    conn = _connect()
+    try:
+        return pd.read_sql_query("""SELECT id, status, created, started, finished, worker, attempts, analysis_id,
+                                           error FROM jobs ORDER BY created DESC LIMIT ?""", conn, params=(limit,))
+    finally:
+        conn.close()
+
+# ---------------------------------
+# Workers
+# ---------------------------------
+def _claim(worker: str):
+    """Toma atómicamente el trabajo en cola más antiguo; recupera antes los que dejaron de latir."""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        conn.execute("""UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'error' ELSE 'queued' END,
+                               error = CASE WHEN attempts >= ? THEN 'worker lost' ELSE error END,
+                               finished = CASE WHEN attempts >= ? THEN ? END
+                        WHERE status='running' AND COALESCE(heartbeat, started) < ?""",
+                     (MAX_ATTEMPTS, MAX_ATTEMPTS, MAX_ATTEMPTS, now, now - STALE_S))
+        row = conn.execute("SELECT id, params, payload, created FROM jobs WHERE status='queued' "
+                           "ORDER BY created LIMIT 1").fetchone()
+        if row:
+            conn.execute("""UPDATE jobs SET status='running', started=?, heartbeat=?, worker=?,
+                                   attempts=attempts+1 WHERE id=?""", (now, now, worker, row[0]))
+        conn.execute("COMMIT")
+        return row
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+# solo el worker que tiene el trabajo puede tocarlo: si se le dio por perdido y otro lo
+# reclamó, sus escrituras no pisan el estado del nuevo dueño
+_OWNED = "id=? AND worker=? AND status='running'"
+
+def _heartbeat(job_id: str, worker: str, stop: threading.Event):
+    while not stop.wait(HEARTBEAT_S):
+        conn = _connect()
+        try:
+            conn.execute(f"UPDATE jobs SET heartbeat=? WHERE {_OWNED}", (time.time(), job_id, worker))
+        except sqlite3.Error:
+            pass    # el siguiente latido lo reintenta
+        finally:
+            conn.close()
+
+def _finish(job_id: str, worker: str, analysis_id: int = None, error: str = None) -> bool:
+    conn = _connect()
+    try:
+        cur = conn.execute(f"UPDATE jobs SET status=?, finished=?, analysis_id=?, error=? WHERE {_OWNED}",
+                           ("error" if error else "done", time.time(), analysis_id, error, job_id, worker))
+    finally:
+        conn.close()
+    if not cur.rowcount:
+        tracing.event("job.lost", worker=worker)
+    return bool(cur.rowcount)
+
+def run_job(row, worker: str = "") -> int:
+    """Ejecuta un trabajo reclamado por `worker` y guarda el resultado en storage; devuelve
+    el analysis_id. Mientras corre, un hilo renueva el latido del trabajo."""
+    job_id, params, payload, created = row
+    from analysis import run_strategic_analysis
+    stop = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, worker, stop), daemon=True,
+                     name=f"qrt-job-heartbeat-{job_id[:8]}").start()
+    try:
+        with tracing.span("job.run", worker=worker, wait_s=time.time() - created):
+            try:
+                res = run_strategic_analysis(**json.loads(payload))
+                analysis_id = storage.save_analysis(json.loads(params), res)
+            except Exception as e:
+                _finish(job_id, worker, error=f"{type(e).__name__}: {e}")
+                raise
+        _finish(job_id, worker, analysis_id)
+    finally:
+        stop.set()
+    return analysis_id
+
+def work(worker: str, stop: threading.Event = None):
+    """Bucle de un worker: reclama, ejecuta y espera POLL_S (o un submit) cuando no hay nada."""
+    while not (stop and stop.is_set()):
+        try:
+            row = _claim(worker)
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            _wake.wait(POLL_S); _wake.clear()
+            continue
+        try:
+            run_job(row, worker)
+        except Exception:
+            pass    # el error queda en la fila del trabajo
+
+def start_workers(n: int = JOB_WORKERS) -> int:
+    """Arranca (una sola vez por proceso) n hilos worker en segundo plano."""
+    with _workers_lock:
+        name = f"{socket.gethostname()}:{os.getpid()}"
+        while len(_workers) < n:
+            t = threading.Thread(target=work, args=(f"{name}:{len(_workers)}",), daemon=True,
+                                 name=f"qrt-job-{len(_workers)}")
+            t.start(); _workers.append(t)
+        return len(_workers)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Analysis job queue worker pool")
+    ap.add_argument("--workers", type=int, default=JOB_WORKERS)
+    ap.add_argument("--list", action="store_true", help="print the most recent jobs and exit")
+    a = ap.parse_args(argv)
+    if a.list:
+        print(list_jobs().to_string(index=False))
+        return 0
+    start_workers(a.workers)
+    print(f"{a.workers} worker(s) polling {_path()} — Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import hashlib, json, os, sqlite3, threading, time
+from storage import DB_PATH
+
+# Caché persistente de respuestas LLM, junto a qrt_history.db
+CACHE_PATH = os.path.join(os.path.dirname(DB_PATH), "qrt_llm_cache.db")
+CACHE_TTL_S = 7 * 24 * 3600      # caducidad de cada entrada
+CACHE_MAX_ENTRIES = 500          # tope LRU
+
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_stats_lock = threading.Lock()      # las secciones se piden desde varios hilos a la vez
+_ready = False
+
+def _connect():
+    global _ready
+    conn = sqlite3.connect(CACHE_PATH)
+    if not _ready:
+        conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache(
+            key TEXT PRIMARY KEY,
+            model TEXT,
+            response TEXT,
+            created REAL,
+            last_access REAL
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_access ON llm_cache(last_access)")
+        conn.commit(); _ready = True
+    return conn
+
+def _count(name: str, n: int = 1):
+    with _stats_lock:
+        _stats[name] += n
+
+def cache_key(messages: list, model: str, temperature: float) -> str:
+    """Hash del prompt completo (system + user) + modelo + temperatura."""
+    blob = json.dumps({"messages": messages, "model": model, "temperature": float(temperature)},
+                      sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def get(key: str):
+    conn = _connect()
+    row = conn.execute("SELECT response, created FROM llm_cache WHERE key=?", (key,)).fetchone()
+    now = time.time()
+    if row is None or now - row[1] > CACHE_TTL_S:
+        if row is not None:
+            conn.execute("DELETE FROM llm_cache WHERE key=?", (key,)); conn.commit()
+        conn.close(); _count("misses")
+        return None
+    conn.execute("UPDATE llm_cache SET last_access=? WHERE key=?", (now, key)); conn.commit()
+    conn.close(); _count("hits")
+    return row[0]
+
+def put(key: str, model: str, response: str):
+    conn = _connect()
+    now = time.time()
+    conn.execute("INSERT OR REPLACE INTO llm_cache(key, model, response, created, last_access) VALUES (?,?,?,?,?)",
+                 (key, model, response, now, now))
+    # caducadas + LRU por encima del tope
+    cur = conn.execute("DELETE FROM llm_cache WHERE created < ?", (now - CACHE_TTL_S,))
+    evicted = cur.rowcount
+    cur = conn.execute("""DELETE FROM llm_cache WHERE key IN (
+        SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)""", (CACHE_MAX_ENTRIES,))
+    evicted += cur.rowcount
+    conn.commit(); conn.close()
+    _count("evictions", max(evicted, 0))
+
+def clear():
+    conn = _connect(); conn.execute("DELETE FROM llm_cache"); conn.commit(); conn.close()
+
+def cache_stats() -> dict:
+    conn = _connect()
+    n = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+    conn.close()
+    with _stats_lock:
+        snap = dict(_stats)
+    total = snap["hits"] + snap["misses"]
+    return {**snap, "entries": n, "hit_rate": (snap["hits"] / total) if total else 0.0}
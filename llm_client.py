@@ -0,0 +1,129 @@
+# llm_client.py — cliente OpenAI compartido para analysis y advisory
+#
+# Un único pool HTTP keep-alive por proceso, timeouts configurables, reintentos con
+# backoff exponencial en 429/5xx/errores de conexión y un semáforo de concurrencia.
+# Registra latencia y tokens de cada llamada en `usage`.
+
+import os, random, threading, time
+import httpx
+from openai import OpenAI, APIConnectionError, APIStatusError, RateLimitError
+
+MODEL = "gpt-4o-mini"
+LLM_TIMEOUT_S = float(os.getenv("QRT_LLM_TIMEOUT", "90"))
+LLM_MAX_RETRIES = int(os.getenv("QRT_LLM_RETRIES", "4"))
+LLM_BACKOFF_S = 1.0
+LLM_MAX_CONCURRENCY = int(os.getenv("QRT_LLM_CONCURRENCY", "8"))
+POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=120)
+
+# Consumo acumulado en el proceso (lo leen batch y las métricas)
+usage = {"calls": 0, "errors": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0,
+         "total_tokens": 0, "latency_s": 0.0}
+_usage_lock = threading.Lock()
+
+_client = None
+_client_lock = threading.Lock()
+_sem = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+def _get_openai_key():
+    """Busca la API key primero en Streamlit Secrets y luego en variables de entorno."""
+    try:
+        from streamlit.runtime.secrets import secrets as st_secrets  # en Streamlit Cloud
+        key = st_secrets.get("OPENAI_API_KEY")
+        if key:
+            return key
+    except Exception:
+        pass
+    return os.getenv("OPENAI_API_KEY")
+
+def get_client() -> OpenAI:
+    """Cliente sync compartido, creado en el primer uso. Los reintentos los hacemos aquí."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(api_key=_get_openai_key(), max_retries=0, timeout=LLM_TIMEOUT_S,
+                                 http_client=httpx.Client(limits=POOL_LIMITS, timeout=LLM_TIMEOUT_S))
+    return _client
+
+def retry_delay(err, attempt: int):
+    """Segundos a esperar antes del reintento, o None si el error no es reintentable."""
+    retryable = isinstance(err, (APIConnectionError, RateLimitError)) or \
+        (isinstance(err, APIStatusError) and err.status_code >= 500)
+    if not retryable:
+        return None
+    try:
+        return min(float(err.response.headers["retry-after"]), 60.0)
+    except Exception:
+        return LLM_BACKOFF_S * 2 ** attempt * (0.5 + random.random())
+
+def _record(t0: float, u=None, error: bool = False):
+    with _usage_lock:
+        usage["calls"] += 1
+        usage["latency_s"] += time.perf_counter() - t0
+        if error:
+            usage["errors"] += 1
+        if u is not None:
+            usage["prompt_tokens"] += getattr(u, "prompt_tokens", 0) or 0
+            usage["completion_tokens"] += getattr(u, "completion_tokens", 0) or 0
+            usage["total_tokens"] += getattr(u, "total_tokens", 0) or 0
+
+def _count_retry():
+    with _usage_lock:
+        usage["retries"] += 1
+
+def chat(messages: list, temperature: float = 0.2, model: str = MODEL, timeout: float = None,
+         max_retries: int = None, **kw):
+    """chat.completions.create con pool, semáforo, reintentos y métricas.
+
+    `max_retries` (por defecto LLM_MAX_RETRIES) permite a quien ya reintenta por su
+    cuenta pasar 0 para que los dos niveles de reintento no se multipliquen.
+    """
+    api = get_client().with_options(timeout=timeout) if timeout else get_client()
+    retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    with _sem:
+        for attempt in range(retries + 1):
+            t0 = time.perf_counter()
+            try:
+                resp = api.chat.completions.create(model=model, messages=messages,
+                                                   temperature=temperature, **kw)
+            except Exception as e:
+                _record(t0, error=True)
+                delay = retry_delay(e, attempt)
+                if delay is None or attempt == retries:
+                    raise
+                _count_retry(); time.sleep(delay)
+                continue
+            _record(t0, getattr(resp, "usage", None))
+            return resp
+
+def chat_stream(messages: list, temperature: float = 0.2, model: str = MODEL, timeout: float = None):
+    """Generador de fragmentos de texto; solo se reintenta la apertura del stream."""
+    api = get_client().with_options(timeout=timeout) if timeout else get_client()
+    with _sem:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            t0 = time.perf_counter()
+            try:
+                stream = api.chat.completions.create(model=model, messages=messages, temperature=temperature,
+                                                     stream=True, stream_options={"include_usage": True})
+                break
+            except Exception as e:
+                _record(t0, error=True)
+                delay = retry_delay(e, attempt)
+                if delay is None or attempt == LLM_MAX_RETRIES:
+                    raise
+                _count_retry(); time.sleep(delay)
+        u = None
+        for chunk in stream:
+            if getattr(chunk, "usage", None):
+                u = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+        _record(t0, u)
+
+def usage_snapshot() -> dict:
+    with _usage_lock:
+        snap = dict(usage)
+    ok = snap["calls"] - snap["errors"]
+    snap["avg_latency_s"] = snap["latency_s"] / snap["calls"] if snap["calls"] else 0.0
+    snap["success_rate"] = ok / snap["calls"] if snap["calls"] else 0.0
+    return snap
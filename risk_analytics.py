@@ -0,0 +1,68 @@
+# risk_analytics.py — analítica de riesgos de toda la cartera (todo el historial guardado)
+#
+# Lee las tablas de resumen que storage mantiene al día en cada save_analysis, así que el
+# coste no crece con el nº de análisis. breakdown() agrega filas crudas para filtros que no
+# están materializados (tecnología, prioridad...).
+
+import pandas as pd
+import storage
+
+def _averages(df: pd.DataFrame) -> pd.DataFrame:
+    scored = df["n_scored"].where(df["n_scored"] > 0)
+    return df.assign(avg_probability=df["sum_probability"] / scored, avg_impact=df["sum_impact"] / scored,
+                     avg_score=df["sum_score"] / scored).drop(
+        columns=["n_scored", "sum_probability", "sum_impact", "sum_score"])
+
+def frequency(by=("category",), countries=None) -> pd.DataFrame:
+    """Nº de riesgos, P1, cuota y medias de prob/impacto/score agrupados por `by` (category y/o country)."""
+    by = [by] if isinstance(by, str) else list(by)
+    df = storage.summary_frame("risk_by_category_country")
+    if countries:
+        df = df[df["country"].isin(countries)]
+    if df.empty:
+        return pd.DataFrame(columns=by + ["n", "n_p1", "share", "avg_probability", "avg_impact", "avg_score"])
+    g = df.groupby(by, as_index=False)[["n", "n_p1", "n_scored", "sum_probability", "sum_impact", "sum_score"]].sum()
+    g["share"] = g["n"] / g["n"].sum()
+    return _averages(g).sort_values("n", ascending=False, ignore_index=True)
+
+def frequency_matrix(value: str = "n") -> pd.DataFrame:
+    """Tabla categoría × país con `value` (n, n_p1 o avg_score)."""
+    f = frequency(by=("category", "country"))
+    if f.empty:
+        return pd.DataFrame()
+    return f.pivot(index="category", columns="country", values=value).fillna(0)
+
+def trends(category: str = None) -> pd.DataFrame:
+    """Medias mensuales de probabilidad, impacto y score (de una categoría o de todas)."""
+    df = storage.summary_frame("risk_by_month")
+    if category:
+        df = df[df["category"] == category]
+    if df.empty:
+        return pd.DataFrame(columns=["month", "n", "avg_probability", "avg_impact", "avg_score"])
+    g = df.groupby("month", as_index=False)[["n", "n_scored", "sum_probability", "sum_impact", "sum_score"]].sum()
+    return _averages(g).sort_values("month", ignore_index=True)
+
+def top_mitigations(n: int = 10, category: str = None) -> pd.DataFrame:
+    """Mitigaciones más repetidas (normalizadas), con las categorías en las que aparecen."""
+    df = storage.summary_frame("risk_mitigations")
+    if category:
+        df = df[df["category"] == category]
+    if df.empty:
+        return pd.DataFrame(columns=["mitigation", "n", "categories"])
+    g = (df.sort_values("n", ascending=False)
+           .groupby("mitigation_key", as_index=False)
+           .agg(mitigation=("mitigation", "first"), n=("n", "sum"),
+                categories=("category", lambda c: ", ".join(sorted(set(c))))))
+    return g.nlargest(n, "n")[["mitigation", "n", "categories"]].reset_index(drop=True)
+
+def breakdown(by="technology", **filters) -> pd.DataFrame:
+    """Agregado sobre las filas crudas (storage.query_risks) para dimensiones no materializadas."""
+    by = [by] if isinstance(by, str) else list(by)
+    r = storage.query_risks(**filters)
+    if r.empty:
+        return pd.DataFrame(columns=by + ["n", "n_p1", "avg_probability", "avg_impact", "avg_score"])
+    r = r.assign(p1=(r["priority"] == "P1").astype(int))
+    return (r.groupby(by, as_index=False)
+             .agg(n=("risk", "size"), n_p1=("p1", "sum"), avg_probability=("probability", "mean"),
+                  avg_impact=("impact", "mean"), avg_score=("score", "mean"))
+             .sort_values("n", ascending=False, ignore_index=True))
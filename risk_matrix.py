@@ -0,0 +1,77 @@
+# risk_matrix.py — matriz probabilidad × impacto: puntuación, prioridad y binning vectorizados
+
+import hashlib, logging
+import numpy as np
+import pandas as pd
+
+SCALE = 5                                   # escala 1..5 de probabilidad e impacto
+PRIORITY_THRESHOLDS = [(15, "P1"), (7, "P2")]   # score >= umbral; el resto P3
+PRIORITIES = ["P1", "P2", "P3"]
+
+log = logging.getLogger(__name__)
+
+_LEVEL_RE = r"(-?\d+(?:\.\d+)?)\s*(?:/\s*(\d+(?:\.\d+)?)|(%))?"
+
+def to_level(values: pd.Series) -> pd.Series:
+    """Nivel numérico de probabilidad/impacto: admite 4, "4", "4 (high)" y fracciones o
+    porcentajes reescalados a 1..SCALE ("3/5" -> 3, "6/10" -> 3, "60%" -> 3); lo demás NaN."""
+    values = pd.Series(values)
+    num = pd.to_numeric(values, errors="coerce").astype(float)
+    text = num.isna() & values.notna()
+    if text.any():
+        m = values[text].astype(str).str.extract(_LEVEL_RE)
+        x = pd.to_numeric(m[0], errors="coerce")
+        den = pd.to_numeric(m[1], errors="coerce")
+        x = x.where(den.isna(), x / den.where(den != 0) * SCALE)
+        x = x.where(m[2].isna(), x / 100 * SCALE)
+        num[text] = x
+    return num
+
+def priority_of(score) -> np.ndarray:
+    """P1/P2/P3 por umbrales de score; None donde el score no es numérico."""
+    score = np.asarray(score, dtype=float)
+    conds = [score >= t for t, _ in PRIORITY_THRESHOLDS] + [~np.isnan(score)]
+    labels = [p for _, p in PRIORITY_THRESHOLDS] + [PRIORITIES[-1]]
+    return np.select(conds, np.array(labels, dtype=object), default=None)
+
+def score_risks(risks_df: pd.DataFrame) -> pd.DataFrame:
+    """Copia con probability/impact numéricos, score = p × i y priority.
+
+    Las filas con valores no interpretables quedan con score NaN y priority None
+    (y se avisa por log) en lugar de dejar toda la tabla sin puntuar.
+    """
+    df = risks_df.copy()
+    if "probability" not in df.columns or "impact" not in df.columns:
+        return df
+    p, i = to_level(df["probability"]), to_level(df["impact"])
+    bad = p.isna() | i.isna()
+    if bad.any():
+        log.warning("%d risk(s) with non-numeric probability/impact: %s", int(bad.sum()),
+                    df.loc[bad, ["probability", "impact"]].head(3).to_dict("records"))
+    df["probability"], df["impact"] = p, i
+    df["score"] = p * i
+    df["priority"] = priority_of(df["score"])
+    return df
+
+def bin_matrix(risks_df: pd.DataFrame, value: str = "score") -> np.ndarray:
+    """Matriz SCALE×SCALE con la suma de `value` por celda (fila 0 = impacto máximo).
+
+    Probabilidad e impacto se recortan a 1..SCALE; las filas sin nivel numérico se ignoran.
+    `value=None` cuenta riesgos en vez de sumar.
+    """
+    m = np.zeros((SCALE, SCALE))
+    if not isinstance(risks_df, pd.DataFrame) or risks_df.empty:
+        return m
+    p, i = to_level(risks_df["probability"]).to_numpy(), to_level(risks_df["impact"]).to_numpy()
+    w = np.ones(len(p)) if value is None else pd.to_numeric(risks_df[value], errors="coerce").to_numpy(float)
+    ok = ~(np.isnan(p) | np.isnan(i) | np.isnan(w))
+    col = np.clip(p[ok], 1, SCALE).astype(int) - 1
+    row = SCALE - np.clip(i[ok], 1, SCALE).astype(int)
+    np.add.at(m, (row, col), w[ok])
+    return m
+
+def matrix_key(m: np.ndarray, *extra) -> str:
+    """Hash del contenido de la matriz (y de los parámetros de render) para cachear gráficos."""
+    h = hashlib.sha1(np.ascontiguousarray(m, dtype=float).tobytes())
+    h.update(repr(extra).encode("utf-8"))
+    return h.hexdigest()
@@ -0,0 +1,167 @@
+import multiprocessing, threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from finance import quick_scenarios
+import tracing
+
+# Distribuciones por variable, como multiplicadores sobre el valor base:
+#   ("normal", sd)  ("lognormal", sigma)  ("uniform", lo, hi)
+#   ("triangular", lo, mode, hi)  ("fixed",)
+DEFAULT_DISTS = {
+    "capex": ("triangular", 0.90, 1.00, 1.25),
+    "opex": ("normal", 0.10),
+    "energy": ("normal", 0.08),
+    "tariff": ("uniform", 0.90, 1.10),
+    "degradation": ("uniform", 0.50, 1.50),
+}
+CHUNK_SIZE = 250_000
+GRID = 4096                  # bins finos de los percentiles en streaming (error < rango/GRID)
+PARALLEL_MIN_PATHS = 1_000_000   # por debajo, repartir en procesos no compensa
+PERCENTILES = (10, 50, 90)
+
+def _sample(rng, spec, base, n):
+    kind = spec[0]
+    if kind == "fixed":
+        mult = np.ones(n)
+    elif kind == "normal":
+        mult = rng.normal(1.0, spec[1], n)
+    elif kind == "lognormal":
+        mult = rng.lognormal(-spec[1] ** 2 / 2, spec[1], n)   # media 1
+    elif kind == "uniform":
+        mult = rng.uniform(spec[1], spec[2], n)
+    elif kind == "triangular":
+        mult = rng.triangular(spec[1], spec[2], spec[3], n)
+    else:
+        raise ValueError(f"Unknown distribution: {kind}")
+    return base * np.maximum(mult, 0.0)
+
+def _eval_chunk(seed, n, base, dists, years, discount):
+    rng = np.random.default_rng(seed)
+    s = {k: _sample(rng, dists.get(k, ("fixed",)), base[k], n) for k in base}
+    res = quick_scenarios(s["capex"], s["opex"], s["tariff"], s["energy"],
+                          years, discount, np.minimum(s["degradation"], 0.99))
+    return res["IRR"], res["LCOE"], np.asarray(res["Payback"], dtype=float)
+
+def _grid(x):
+    # rango fijo de los bins finos, sacado del primer bloque (determinista por semilla);
+    # holgura amplia para que los bloques siguientes caigan dentro
+    x = x[np.isfinite(x)]
+    if x.size == 0:
+        return np.linspace(0, 1, GRID + 1)
+    lo, hi = np.percentile(x, [0.1, 99.9])
+    pad = (hi - lo) * 0.5 or abs(lo) * 0.1 or 1.0
+    return np.linspace(lo - pad, hi + pad, GRID + 1)
+
+def _tally(x, edges):
+    # (conteos por bin fino, nº de valores finitos, suma): todo lo que sobrevive al bloque
+    x = x[np.isfinite(x)]
+    counts, _ = np.histogram(np.clip(x, edges[0], edges[-1]), bins=edges)
+    return counts, x.size, float(x.sum())
+
+def _run_chunk(args):
+    """Evalúa un bloque de caminos y devuelve solo sus conteos; memoria acotada por el bloque."""
+    seed, n, base, dists, years, discount, edges_irr, edges_lc, payback_within = args
+    irr, lc, pb = _eval_chunk(seed, n, base, dists, years, discount)
+    return _tally(irr, edges_irr), _tally(lc, edges_lc), int(np.sum(pb <= payback_within))
+
+def _merge(a, b):
+    return a[0] + b[0], a[1] + b[1], a[2] + b[2]
+
+def _quantiles(counts, edges, q):
+    # percentil interpolando linealmente dentro del bin fino
+    cum = np.cumsum(counts)
+    target = np.asarray(q, dtype=float) / 100 * cum[-1]
+    i = np.minimum(np.searchsorted(cum, target), len(counts) - 1)
+    frac = (target - (cum[i] - counts[i])) / np.maximum(counts[i], 1)
+    return edges[i] + np.clip(frac, 0, 1) * (edges[i + 1] - edges[i])
+
+def _summary(tally, edges):
+    counts, n, total = tally
+    if n == 0:
+        return {f"P{p}": np.nan for p in PERCENTILES} | {"mean": np.nan}
+    pct = _quantiles(counts, edges, PERCENTILES)
+    return {f"P{p}": float(v) for p, v in zip(PERCENTILES, pct)} | {"mean": total / n}
+
+def _hist(tally, edges, bins):
+    counts, n, _ = tally
+    if n == 0:
+        return np.zeros(bins, dtype=int), np.linspace(0, 1, bins + 1)
+    lo, hi = _quantiles(counts, edges, [0.5, 99.5])   # recorta colas extremas para la visualización
+    centers = (edges[:-1] + edges[1:]) / 2
+    h, e = np.histogram(np.clip(centers, lo, hi), bins=bins, range=(lo, hi if hi > lo else lo + 1e-9),
+                        weights=counts)
+    return h.astype(int), e
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+def _pool(workers: int) -> ProcessPoolExecutor:
+    # un único pool por proceso: arrancar intérpretes con "spawn" cuesta segundos por clic
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _executor_workers = workers
+    return _executor
+
+def _reset_pool():
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+@tracing.traced("finance.monte_carlo")
+def monte_carlo(capex, opex, tariff_usd_mwh, energy_mwh, n_paths=100_000, years=25,
+                discount=0.08, degradation=0.005, dists=None, payback_within=10,
+                seed=None, chunk_size=CHUNK_SIZE, workers=1, bins=50):
+    """Simulación Monte Carlo de IRR/LCOE/payback sobre quick_scenarios.
+
+    Cada bloque de `chunk_size` caminos usa su propia semilla derivada de `seed`,
+    así que el resultado es reproducible con independencia de `workers`. De cada
+    bloque solo se conservan histogramas finos (GRID bins sobre un rango fijado por el
+    primer bloque), de los que salen percentiles e histograma: la memoria no crece con
+    `n_paths`.
+    Con `workers > 1` y al menos PARALLEL_MIN_PATHS caminos, los bloques se reparten en
+    un pool de procesos persistente arrancado con "spawn": hacer fork de un proceso con
+    hilos vivos (Streamlit, workers de jobs, pool de exportación) puede heredar locks
+    tomados y bloquear a los hijos.
+    """
+    dists = {**DEFAULT_DISTS, **(dists or {})}
+    base = {"capex": capex, "opex": opex, "tariff": tariff_usd_mwh,
+            "energy": energy_mwh, "degradation": degradation}
+    sizes = [chunk_size] * (n_paths // chunk_size)
+    if n_paths % chunk_size:
+        sizes.append(n_paths % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    # el primer bloque fija los bins finos del resto
+    irr, lc, pb = _eval_chunk(seeds[0], sizes[0], base, dists, years, discount)
+    edges_irr, edges_lc = _grid(irr), _grid(lc)
+    t_irr, t_lc, n_pb = _tally(irr, edges_irr), _tally(lc, edges_lc), int(np.sum(pb <= payback_within))
+    del irr, lc, pb
+    jobs = [(sd, n, base, dists, years, discount, edges_irr, edges_lc, payback_within)
+            for sd, n in zip(seeds[1:], sizes[1:])]
+
+    parts = None
+    if workers > 1 and len(jobs) > 1 and n_paths >= PARALLEL_MIN_PATHS:
+        try:
+            parts = list(_pool(workers).map(_run_chunk, jobs))
+        except BrokenProcessPool:
+            _reset_pool(); parts = None
+    for a, b, c in parts if parts is not None else map(_run_chunk, jobs):
+        t_irr, t_lc, n_pb = _merge(t_irr, a), _merge(t_lc, b), n_pb + c
+
+    return {
+        "n_paths": n_paths,
+        "seed": seed,
+        "IRR": _summary(t_irr, edges_irr),
+        "LCOE": _summary(t_lc, edges_lc),
+        "payback_within": payback_within,
+        "prob_payback": n_pb / n_paths,
+        "prob_irr_undefined": 1 - t_irr[1] / n_paths,
+        "hist_IRR": _hist(t_irr, edges_irr, bins),
+        "hist_LCOE": _hist(t_lc, edges_lc, bins),
+    }
@@ -1,34 +1,403 @@
-import json, sqlite3, pandas as pd
+import io, json, queue, re, sqlite3, threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import tracing
 
 DB_PATH = "qrt_history.db"
+POOL_SIZE = 4
 
-def _connect():
-    return sqlite3.connect(DB_PATH)
+# ---------------------------------
+# Pool de conexiones (WAL) y esquema
+# ---------------------------------
+_pools = {}                 # DB_PATH -> Queue de conexiones abiertas
+_pool_lock = threading.Lock()
+_fts = {}                   # DB_PATH -> True si SQLite trae FTS5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+    params TEXT,
+    exec_summary TEXT,
+    risks_csv TEXT
+);
+CREATE TABLE IF NOT EXISTS risks(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+    category TEXT, risk TEXT, probability REAL, impact REAL, score REAL,
+    priority TEXT, mitigation TEXT
+);
+CREATE TABLE IF NOT EXISTS pestel(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+    factor TEXT, points TEXT, assessment TEXT
+);
+CREATE TABLE IF NOT EXISTS swot(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+    quadrant TEXT, pos INTEGER, item TEXT
+);
+"""
+# columnas añadidas a `analyses` sobre el esquema original (migración in-place)
+ANALYSIS_COLUMNS = {"country": "TEXT", "technology": "TEXT", "capacity_mw": "REAL", "client": "TEXT",
+                    "offtaker": "TEXT", "horizon": "TEXT", "legal_fiscal": "TEXT", "logistics": "TEXT",
+                    "recommendations": "TEXT", "max_risk_score": "REAL"}
+INDEXES = """
+CREATE INDEX IF NOT EXISTS ix_analyses_country ON analyses(country);
+CREATE INDEX IF NOT EXISTS ix_analyses_technology ON analyses(technology);
+CREATE INDEX IF NOT EXISTS ix_analyses_ts ON analyses(ts);
+CREATE INDEX IF NOT EXISTS ix_analyses_score ON analyses(max_risk_score);
+CREATE INDEX IF NOT EXISTS ix_risks_analysis ON risks(analysis_id);
+CREATE INDEX IF NOT EXISTS ix_risks_priority ON risks(priority, category);
+CREATE INDEX IF NOT EXISTS ix_risks_category ON risks(category);
+CREATE INDEX IF NOT EXISTS ix_pestel_analysis ON pestel(analysis_id);
+CREATE INDEX IF NOT EXISTS ix_swot_analysis ON swot(analysis_id);
+"""
+# resúmenes materializados de riesgos de toda la cartera (se actualizan en cada guardado)
+SUMMARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS risk_by_category_country(
+    category TEXT NOT NULL, country TEXT NOT NULL, n INTEGER, n_p1 INTEGER, n_scored INTEGER,
+    sum_probability REAL, sum_impact REAL, sum_score REAL,
+    PRIMARY KEY (category, country)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS risk_by_month(
+    month TEXT NOT NULL, category TEXT NOT NULL, n INTEGER, n_scored INTEGER,
+    sum_probability REAL, sum_impact REAL, sum_score REAL,
+    PRIMARY KEY (month, category)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS risk_mitigations(
+    category TEXT NOT NULL, mitigation_key TEXT NOT NULL, mitigation TEXT, n INTEGER,
+    PRIMARY KEY (category, mitigation_key)
+) WITHOUT ROWID;
+"""
+# búsqueda de texto en los resúmenes: tabla FTS5 de contenido externo, sincronizada por triggers
+FTS = """
+CREATE VIRTUAL TABLE analyses_fts USING fts5(exec_summary, content='analyses', content_rowid='id');
+CREATE TRIGGER analyses_fts_ai AFTER INSERT ON analyses BEGIN
+    INSERT INTO analyses_fts(rowid, exec_summary) VALUES (new.id, new.exec_summary);
+END;
+CREATE TRIGGER analyses_fts_ad AFTER DELETE ON analyses BEGIN
+    INSERT INTO analyses_fts(analyses_fts, rowid, exec_summary) VALUES ('delete', old.id, old.exec_summary);
+END;
+CREATE TRIGGER analyses_fts_au AFTER UPDATE OF exec_summary ON analyses BEGIN
+    INSERT INTO analyses_fts(analyses_fts, rowid, exec_summary) VALUES ('delete', old.id, old.exec_summary);
+    INSERT INTO analyses_fts(rowid, exec_summary) VALUES (new.id, new.exec_summary);
+END;
+INSERT INTO analyses_fts(analyses_fts) VALUES ('rebuild');
+"""
+
+def _open():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.create_function("qrt_mitigation_key", 1, _mitigation_key, deterministic=True)
+    return conn
+
+def _init_schema(conn):
+    conn.executescript(SCHEMA)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(analyses)")}
+    missing = [c for c in ANALYSIS_COLUMNS if c not in cols]
+    for c in missing:
+        conn.execute(f"ALTER TABLE analyses ADD COLUMN {c} {ANALYSIS_COLUMNS[c]}")
+    conn.executescript(INDEXES)
+    if missing:
+        _migrate_legacy(conn)
+    conn.executescript(SUMMARY_SCHEMA)
+    if not conn.execute("SELECT 1 FROM risk_by_category_country LIMIT 1").fetchone():
+        _rebuild_summaries(conn)
+    _fts[DB_PATH] = _init_fts(conn)
+    conn.commit()
+
+def _init_fts(conn) -> bool:
+    """Crea el índice FTS5 (y lo rellena) la primera vez; False si SQLite no trae FTS5."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name='analyses_fts'").fetchone():
+        return True
+    try:
+        with conn:
+            conn.executescript("BEGIN;" + FTS + "COMMIT;")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def _migrate_legacy(conn):
+    """Rellena las columnas/tablas nuevas a partir de filas antiguas (params JSON + risks_csv)."""
+    for c in ["country", "technology", "capacity_mw", "client", "offtaker", "horizon"]:
+        conn.execute(f"UPDATE analyses SET {c} = json_extract(params, '$.{c}') "
+                     f"WHERE {c} IS NULL AND json_valid(params)")
+    rows = conn.execute("""SELECT id, risks_csv FROM analyses
+                           WHERE risks_csv IS NOT NULL AND risks_csv != ''
+                           AND id NOT IN (SELECT analysis_id FROM risks)""").fetchall()
+    for aid, csv_text in rows:
+        try:
+            _insert_children(conn, [(aid, {"risks": pd.read_csv(io.StringIO(csv_text))})])
+        except Exception:
+            pass
+    conn.execute("""UPDATE analyses SET max_risk_score = (SELECT MAX(score) FROM risks WHERE analysis_id = analyses.id)
+                    WHERE max_risk_score IS NULL""")
+
+def _pool():
+    with _pool_lock:
+        if DB_PATH not in _pools:
+            conn = _open(); _init_schema(conn)
+            q = queue.Queue(maxsize=POOL_SIZE)
+            q.put(conn)
+            _pools[DB_PATH] = q
+        return _pools[DB_PATH]
+
+@contextmanager
+def _connection():
+    """Conexión del pool (abre una nueva si están todas ocupadas) en una transacción."""
+    pool = _pool()
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _open()
+    try:
+        with conn:
+            yield conn
+    finally:
+        try:
+            pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+# ---------------------------------
+# Escritura
+# ---------------------------------
+def _num(x):
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return None
+
+def _analysis_row(params: dict, res: dict):
+    return (json.dumps(params), res.get("executive_summary", ""),
+            params.get("country"), params.get("technology"), _num(params.get("capacity_mw")),
+            params.get("client"), params.get("offtaker"), params.get("horizon"),
+            res.get("legal_fiscal", ""), res.get("logistics", ""),
+            json.dumps(res.get("recommendations", [])))
+
+def _columns(df: pd.DataFrame, cols: list):
+    """Columnas como listas Python (None si falta), más rápido que to_dict por fila."""
+    return [df[c].astype(object).where(df[c].notna(), None).tolist() if c in df.columns else [None] * len(df)
+            for c in cols]
+
+def _stack(items, key: str) -> pd.DataFrame:
+    """Concatena la tabla `key` de todos los resultados con su analysis_id (una sola pasada)."""
+    pairs = [(aid, res[key]) for aid, res in items
+             if isinstance(res.get(key), pd.DataFrame) and not res[key].empty]
+    if not pairs:
+        return pd.DataFrame()
+    # sin claves en concat (el MultiIndex es lo caro con miles de tablas pequeñas)
+    out = pd.concat([df for _, df in pairs], ignore_index=True)
+    out["analysis_id"] = np.repeat([aid for aid, _ in pairs], [len(df) for _, df in pairs])
+    return out
+
+def _insert_children(conn, items):
+    """items: [(analysis_id, res)] -> filas de risks/pestel/swot con executemany."""
+    r = _stack(items, "risks")
+    if not r.empty:
+        aid, cat, risk, p, i, sc, pr, mit = _columns(r, ["analysis_id", "category", "risk", "probability",
+                                                        "impact", "score", "priority", "mitigation"])
+        conn.executemany("""INSERT INTO risks(analysis_id, category, risk, probability, impact, score, priority, mitigation)
+                            VALUES (?,?,?,?,?,?,?,?)""",
+                         zip(aid, cat, risk, map(_num, p), map(_num, i), map(_num, sc), pr, mit))
+    p = _stack(items, "pestel")
+    if not p.empty:
+        aid, factor, pts, assessment = _columns(p, ["analysis_id", "factor", "points", "assessment"])
+        pts = [json.dumps(x if isinstance(x, list) else [x]) for x in pts]
+        conn.executemany("INSERT INTO pestel(analysis_id, factor, points, assessment) VALUES (?,?,?,?)",
+                         zip(aid, factor, pts, assessment))
+    swot = [(aid, quadrant, i, str(item)) for aid, res in items
+            for quadrant, its in (res.get("swot") or {}).items() for i, item in enumerate(its or [])]
+    conn.executemany("INSERT INTO swot(analysis_id, quadrant, pos, item) VALUES (?,?,?,?)", swot)
+
+# ---------------------------------
+# Resúmenes materializados (incrementales)
+# ---------------------------------
+SUMMARY_TABLES = ["risk_by_category_country", "risk_by_month", "risk_mitigations"]
+
+def _mitigation_key(text):
+    # misma mitigación con otra capitalización/espacios/puntuación final cuenta como una
+    if text is None:
+        return None
+    return re.sub(r"\s+", " ", str(text).lower()).strip().rstrip(".;,:").strip() or None
+
+# Agregados de los riesgos de los análisis con id >= ?, sumados a lo ya materializado (upsert).
+# Todo en SQLite: sin round-trip a pandas en cada guardado.
+_SUMMARY_UPSERTS = [
+    """INSERT INTO risk_by_category_country
+       SELECT COALESCE(r.category, 'Other'), COALESCE(a.country, ''), COUNT(*), TOTAL(r.priority = 'P1'),
+              COUNT(r.score), TOTAL(r.probability), TOTAL(r.impact), TOTAL(r.score)
+       FROM risks r JOIN analyses a ON a.id = r.analysis_id WHERE r.analysis_id >= ? GROUP BY 1, 2
+       ON CONFLICT(category, country) DO UPDATE SET n = n + excluded.n, n_p1 = n_p1 + excluded.n_p1,
+         n_scored = n_scored + excluded.n_scored, sum_probability = sum_probability + excluded.sum_probability,
+         sum_impact = sum_impact + excluded.sum_impact, sum_score = sum_score + excluded.sum_score""",
+    """INSERT INTO risk_by_month
+       SELECT COALESCE(substr(a.ts, 1, 7), ''), COALESCE(r.category, 'Other'), COUNT(*), COUNT(r.score),
+              TOTAL(r.probability), TOTAL(r.impact), TOTAL(r.score)
+       FROM risks r JOIN analyses a ON a.id = r.analysis_id WHERE r.analysis_id >= ? GROUP BY 1, 2
+       ON CONFLICT(month, category) DO UPDATE SET n = n + excluded.n, n_scored = n_scored + excluded.n_scored,
+         sum_probability = sum_probability + excluded.sum_probability,
+         sum_impact = sum_impact + excluded.sum_impact, sum_score = sum_score + excluded.sum_score""",
+    """INSERT INTO risk_mitigations
+       SELECT COALESCE(category, 'Other'), qrt_mitigation_key(mitigation) AS k, MIN(mitigation), COUNT(*)
+       FROM risks WHERE analysis_id >= ? GROUP BY 1, 2 HAVING k IS NOT NULL
+       ON CONFLICT(category, mitigation_key) DO UPDATE SET n = n + excluded.n""",
+]
+
+def _update_summaries(conn, first_id: int):
+    """Añade a los resúmenes los riesgos de los análisis con id >= first_id (los recién insertados)."""
+    for sql in _SUMMARY_UPSERTS:
+        conn.execute(sql, (first_id,))
+
+def _rebuild_summaries(conn):
+    for t in SUMMARY_TABLES:
+        conn.execute(f"DELETE FROM {t}")
+    _update_summaries(conn, 0)
+
+def rebuild_summaries():
+    """Recalcula desde cero las tablas de resumen (p.ej. tras borrar análisis a mano)."""
+    with _connection() as conn:
+        _rebuild_summaries(conn)
+
+def save_analyses(items):
+    """Guarda muchos (params, res) en una sola transacción. Devuelve los ids."""
+    ids = []
+    with tracing.span("storage.save", n=len(items)), _connection() as conn:
+        for params, res in items:
+            cur = conn.execute("""INSERT INTO analyses(params, exec_summary, country, technology, capacity_mw,
+                                  client, offtaker, horizon, legal_fiscal, logistics, recommendations)
+                                  VALUES (?,?,?,?,?,?,?,?,?,?,?)""", _analysis_row(params, res))
+            ids.append(cur.lastrowid)
+        _insert_children(conn, [(aid, res) for aid, (_, res) in zip(ids, items)])
+        if ids:
+            conn.execute("""UPDATE analyses SET max_risk_score = (SELECT MAX(score) FROM risks
+                            WHERE analysis_id = analyses.id) WHERE id >= ?""", (ids[0],))
+            _update_summaries(conn, ids[0])
+    return ids
 
 def save_analysis(params: dict, res: dict):
-    conn = _connect()
-    cur = conn.cursor()
-    cur.execute("""CREATE TABLE IF NOT EXISTS analyses(
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        ts DATETIME DEFAULT CURRENT_TIMESTAMP,
-        params TEXT,
-        exec_summary TEXT,
-        risks_csv TEXT
-    )""")
-    risks_csv = ""
-    if "risks" in res and hasattr(res["risks"], "to_csv"):
-        risks_csv = res["risks"].to_csv(index=False)
-    cur.execute("INSERT INTO analyses(params, exec_summary, risks_csv) VALUES (?,?,?)",
-                (json.dumps(params), res.get("executive_summary",""), risks_csv))
-    conn.commit(); conn.close()
+    return save_analyses([(params, res)])[0]
+
+# ---------------------------------
+# Lectura
+# ---------------------------------
+def _query(sql: str, params=()) -> pd.DataFrame:
+    with _connection() as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+HISTORY_COLUMNS = ["id", "ts", "country", "technology", "capacity_mw", "max_risk_score"]
+DETAIL_COLUMNS = ["id", "ts", "params", "exec_summary", "country", "technology", "capacity_mw", "client",
+                  "offtaker", "horizon", "legal_fiscal", "logistics", "recommendations", "max_risk_score"]
 
 def list_analyses(limit=50):
-    conn = _connect()
-    df = pd.read_sql_query("SELECT id, ts FROM analyses ORDER BY id DESC LIMIT ?", conn, params=(limit,))
-    conn.close(); return df
-
-def load_analysis(analysis_id: int):
-    conn = _connect()
-    row = pd.read_sql_query("SELECT * FROM analyses WHERE id=?", conn, params=(analysis_id,)).iloc[0]
-    conn.close()
-    return row
+    return _query("SELECT id, ts, country, technology, capacity_mw FROM analyses ORDER BY id DESC LIMIT ?",
+                  (limit,))
+
+def _fts_query(text: str) -> str:
+    # cada palabra entre comillas: sin sintaxis FTS5 del usuario; prefijo en la última
+    words = [w.replace('"', '""') for w in text.split()]
+    return " ".join(f'"{w}"' for w in words) + ("*" if words else "")
+
+def page_analyses(before_id=None, limit=25, country=None, technology=None, date_from=None, date_to=None,
+                  min_risk_score=None, search=None):
+    """Una página del historial, del más reciente al más antiguo (paginación por id).
+
+    Devuelve (DataFrame con HISTORY_COLUMNS, cursor) donde cursor es el `before_id` de la
+    página siguiente o None si no hay más. Los filtros se resuelven en SQLite con índices.
+    """
+    where, args = [], []
+    if before_id is not None:
+        where.append("id < ?"); args.append(int(before_id))
+    if country:
+        where.append("country = ?"); args.append(country)
+    if technology:
+        where.append("technology = ?"); args.append(technology)
+    if date_from:
+        where.append("ts >= ?"); args.append(str(date_from))
+    if date_to:
+        where.append("ts < date(?, '+1 day')"); args.append(str(date_to))
+    if min_risk_score:
+        where.append("max_risk_score >= ?"); args.append(float(min_risk_score))
+    if search and search.strip():
+        _pool()
+        if _fts.get(DB_PATH):
+            where.append("id IN (SELECT rowid FROM analyses_fts WHERE analyses_fts MATCH ?)")
+            args.append(_fts_query(search))
+        else:
+            where.append("exec_summary LIKE ?"); args.append(f"%{search.strip()}%")
+    sql = f"SELECT {', '.join(HISTORY_COLUMNS)} FROM analyses"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC LIMIT ?"; args.append(int(limit) + 1)
+    df = _query(sql, args)
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        return df, int(df["id"].iloc[-1])
+    return df, None
+
+def history_facets() -> dict:
+    """Valores distintos de país y tecnología para los filtros del historial."""
+    with _connection() as conn:
+        return {c: [r[0] for r in conn.execute(f"SELECT DISTINCT {c} FROM analyses WHERE {c} IS NOT NULL ORDER BY {c}")]
+                for c in ("country", "technology")}
+
+def load_analysis(analysis_id: int, columns=None):
+    """Fila de `analyses`; `columns` limita la proyección (p.ej. ["id", "ts", "exec_summary"])."""
+    cols = [c for c in (columns or DETAIL_COLUMNS) if c in DETAIL_COLUMNS]
+    df = _query(f"SELECT {', '.join(cols)} FROM analyses WHERE id=?", (analysis_id,))
+    if df.empty:
+        raise KeyError(f"analysis {analysis_id} not found")
+    return df.iloc[0]
+
+def load_result(analysis_id: int):
+    """Reconstruye (params, res) de un análisis guardado, con el mismo formato que devuelve analysis."""
+    with _connection() as conn:
+        row = conn.execute("""SELECT params, exec_summary, legal_fiscal, logistics, recommendations
+                              FROM analyses WHERE id=?""", (analysis_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"analysis {analysis_id} not found")
+        risks = pd.read_sql_query("""SELECT category, risk, probability, impact, mitigation, score, priority
+                                     FROM risks WHERE analysis_id=? ORDER BY id""", conn, params=(analysis_id,))
+        pestel = pd.read_sql_query("SELECT factor, points, assessment FROM pestel WHERE analysis_id=? ORDER BY id",
+                                   conn, params=(analysis_id,))
+        swot_rows = conn.execute("SELECT quadrant, item FROM swot WHERE analysis_id=? ORDER BY quadrant, pos",
+                                 (analysis_id,)).fetchall()
+    params, summary, legal_fiscal, logistics, recs = row
+    pestel["points"] = [json.loads(p) if p else [] for p in pestel["points"]]
+    swot = {q: [] for q in ("strengths", "weaknesses", "opportunities", "threats")}
+    for quadrant, item in swot_rows:
+        swot.setdefault(quadrant, []).append(item)
+    res = {"executive_summary": summary or "", "pestel": pestel, "swot": swot, "risks": risks,
+           "legal_fiscal": legal_fiscal or "", "logistics": logistics or "",
+           "recommendations": json.loads(recs) if recs else []}
+    return json.loads(params) if params else {}, res
+
+def summary_frame(table: str) -> pd.DataFrame:
+    """Contenido de una de las SUMMARY_TABLES (son pequeñas: una fila por grupo)."""
+    if table not in SUMMARY_TABLES:
+        raise ValueError(f"unknown summary table: {table}")
+    return _query(f"SELECT * FROM {table}")
+
+def query_risks(priority=None, category=None, countries=None, technology=None, limit=None) -> pd.DataFrame:
+    """Riesgos de todos los análisis, filtrados por índices (p.ej. P1 regulatorios en islas)."""
+    where, args = [], []
+    if priority:
+        where.append("r.priority = ?"); args.append(priority)
+    if category:
+        where.append("r.category = ?"); args.append(category)
+    if countries:
+        where.append(f"a.country IN ({','.join('?' * len(countries))})"); args.extend(countries)
+    if technology:
+        where.append("a.technology = ?"); args.append(technology)
+    sql = ("SELECT r.analysis_id, a.ts, a.country, a.technology, r.category, r.risk, r.probability, "
+           "r.impact, r.score, r.priority, r.mitigation FROM risks r JOIN analyses a ON a.id = r.analysis_id")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY r.score DESC"
+    if limit:
+        sql += " LIMIT ?"; args.append(int(limit))
+    return _query(sql, args)
@@ -0,0 +1,199 @@
+# tracing.py — spans ligeros (duración, tokens, aciertos de caché) con sumidero SQLite/JSONL
+#
+#   with tracing.span("llm.call", model=MODEL) as sp:
+#       ...; sp["tokens"] = 1234; sp["cache_hit"] = False
+#
+#   @tracing.traced("chart.risk_heatmap")
+#   def risk_heatmap(...): ...
+#
+# Los spans se acumulan en memoria y se escriben por lotes (QRT_TRACE_SINK=sqlite|jsonl|off).
+# stats() da p50/p95 por etapa y prometheus_text() un snapshot en formato de exposición.
+
+import atexit, contextvars, functools, json, os, sqlite3, threading, time, uuid
+from contextlib import contextmanager
+import pandas as pd
+
+TRACE_SINK = os.getenv("QRT_TRACE_SINK", "sqlite")
+FLUSH_EVERY = 50            # spans en memoria antes de escribir
+FLUSH_INTERVAL_S = 5.0
+STATS_LIMIT = 50_000        # spans más recientes que entran en stats()
+
+_buffer = []
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+_ready = set()
+_current = contextvars.ContextVar("qrt_span", default=None)
+
+def _paths():
+    from storage import DB_PATH       # import diferido: storage también usa tracing
+    base = os.path.dirname(DB_PATH)
+    return os.path.join(base, "qrt_traces.db"), os.path.join(base, "qrt_traces.jsonl")
+
+@contextmanager
+def span(name: str, **attrs):
+    """Mide el bloque; el dict devuelto admite atributos extra (tokens, cache_hit, n...)."""
+    if TRACE_SINK == "off":
+        yield attrs
+        return
+    parent = _current.get()
+    ctx = {"trace": parent["trace"] if parent else uuid.uuid4().hex[:16], "name": name}
+    token = _current.set(ctx)
+    t0, ts = time.perf_counter(), time.time()
+    status, error = "ok", None
+    try:
+        yield attrs
+    except BaseException as e:
+        status, error = "error", type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        _emit({"ts": ts, "name": name, "duration_s": time.perf_counter() - t0, "status": status,
+               "error": error, "trace": ctx["trace"], "parent": parent["name"] if parent else None,
+               "attrs": attrs})
+
+def traced(name: str = None):
+    """Decorador: cada llamada a la función es un span."""
+    def deco(fn):
+        label = name or f"{fn.__module__}.{fn.__name__}"
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def event(name: str, **attrs):
+    """Suceso sin duración (p.ej. un JSON del LLM que no parsea)."""
+    with span(name, **attrs):
+        pass
+
+# ---------------------------------
+# Sumidero
+# ---------------------------------
+def _emit(rec: dict):
+    global _last_flush
+    with _lock:
+        _buffer.append(rec)
+        due = len(_buffer) >= FLUSH_EVERY or time.monotonic() - _last_flush > FLUSH_INTERVAL_S
+    if due:
+        flush()
+
+def _connect(path: str):
+    conn = sqlite3.connect(path, timeout=30)
+    if path not in _ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS spans(
+            id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL, name TEXT, duration_s REAL, status TEXT,
+            error TEXT, trace TEXT, parent TEXT, attrs TEXT)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_spans_name_ts ON spans(name, ts)")
+        conn.commit(); _ready.add(path)
+    return conn
+
+def flush():
+    """Escribe los spans pendientes en el sumidero configurado."""
+    global _buffer, _last_flush
+    with _lock:
+        batch, _buffer, _last_flush = _buffer, [], time.monotonic()
+    if not batch or TRACE_SINK == "off":
+        return
+    db_path, jsonl_path = _paths()
+    try:
+        if TRACE_SINK == "jsonl":
+            with open(jsonl_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(r, default=str) + "\n" for r in batch)
+        else:
+            conn = _connect(db_path)
+            with conn:
+                conn.executemany("""INSERT INTO spans(ts, name, duration_s, status, error, trace, parent, attrs)
+                                    VALUES (?,?,?,?,?,?,?,?)""",
+                                 [(r["ts"], r["name"], r["duration_s"], r["status"], r["error"], r["trace"],
+                                   r["parent"], json.dumps(r["attrs"], default=str)) for r in batch])
+            conn.close()
+    except (OSError, sqlite3.Error):
+        pass    # la instrumentación nunca debe tumbar la petición
+
+atexit.register(flush)
+
+# ---------------------------------
+# Lectura: percentiles y Prometheus
+# ---------------------------------
+def load_spans(since: float = None, limit: int = STATS_LIMIT) -> pd.DataFrame:
+    """Spans recientes con tokens y cache_hit extraídos de attrs."""
+    flush()
+    db_path, jsonl_path = _paths()
+    cols = ["ts", "name", "duration_s", "status", "tokens", "cache_hit"]
+    if TRACE_SINK == "jsonl":
+        if not os.path.exists(jsonl_path):
+            return pd.DataFrame(columns=cols)
+        df = pd.read_json(jsonl_path, lines=True).tail(limit)
+        if df.empty:
+            return pd.DataFrame(columns=cols)
+        attrs = pd.json_normalize(df.pop("attrs").tolist()).set_index(df.index)
+        for c in ("tokens", "cache_hit"):
+            df[c] = attrs[c] if c in attrs.columns else None
+        df = df[df["ts"] >= since] if since else df
+        return df[cols]
+    if not os.path.exists(db_path):
+        return pd.DataFrame(columns=cols)
+    conn = _connect(db_path)
+    try:
+        return pd.read_sql_query("""SELECT ts, name, duration_s, status, json_extract(attrs, '$.tokens') AS tokens,
+                                           json_extract(attrs, '$.cache_hit') AS cache_hit
+                                    FROM spans WHERE ts >= ? ORDER BY id DESC LIMIT ?""",
+                                 conn, params=(since or 0, limit))
+    finally:
+        conn.close()
+
+def stats(since: float = None) -> pd.DataFrame:
+    """Por etapa: nº de spans, errores, p50/p95/media (ms), tokens y tasa de aciertos de caché."""
+    df = load_spans(since)
+    out_cols = ["stage", "count", "errors", "p50_ms", "p95_ms", "mean_ms", "tokens", "cache_hit_rate"]
+    if df.empty:
+        return pd.DataFrame(columns=out_cols)
+    df = df.assign(ms=df["duration_s"] * 1000, err=(df["status"] == "error").astype(int),
+                   tokens=pd.to_numeric(df["tokens"], errors="coerce"),
+                   cache_hit=pd.to_numeric(df["cache_hit"], errors="coerce"))
+    g = df.groupby("name")
+    out = pd.DataFrame({"count": g.size(), "errors": g["err"].sum(),
+                        "p50_ms": g["ms"].quantile(0.5), "p95_ms": g["ms"].quantile(0.95),
+                        "mean_ms": g["ms"].mean(), "tokens": g["tokens"].sum(min_count=1),
+                        "cache_hit_rate": g["cache_hit"].mean()})
+    return out.rename_axis("stage").reset_index()[out_cols].sort_values("p95_ms", ascending=False,
+                                                                        ignore_index=True)
+
+def _label(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"')
+
+def prometheus_text(since: float = None) -> str:
+    """Snapshot en formato de exposición de Prometheus (text/plain; version=0.0.4).
+
+    Todo se calcula sobre los spans de la ventana `since`, que puede bajar de un
+    snapshot a otro: por eso se exporta como gauge y no como counter/summary.
+    """
+    st, df = stats(since), load_spans(since)
+    sums = df.groupby("name")["duration_s"].sum() if not df.empty else {}
+    lines = ["# HELP qrt_stage_duration_seconds Stage duration quantiles over the snapshot window.",
+             "# TYPE qrt_stage_duration_seconds gauge"]
+    for r in st.itertuples(index=False):
+        s = _label(r.stage)
+        lines += [f'qrt_stage_duration_seconds{{stage="{s}",quantile="0.5"}} {r.p50_ms / 1000:.6f}',
+                  f'qrt_stage_duration_seconds{{stage="{s}",quantile="0.95"}} {r.p95_ms / 1000:.6f}']
+    lines += ["# HELP qrt_stage_busy_seconds Total time spent in each stage over the snapshot window.",
+              "# TYPE qrt_stage_busy_seconds gauge"]
+    lines += [f'qrt_stage_busy_seconds{{stage="{_label(r.stage)}"}} {sums[r.stage]:.6f}'
+              for r in st.itertuples(index=False)]
+    lines += ["# HELP qrt_stage_spans Spans recorded per stage over the snapshot window.",
+              "# TYPE qrt_stage_spans gauge"]
+    lines += [f'qrt_stage_spans{{stage="{_label(r.stage)}"}} {r.count}' for r in st.itertuples(index=False)]
+    lines += ["# HELP qrt_stage_errors Spans that ended with an exception over the snapshot window.",
+              "# TYPE qrt_stage_errors gauge"]
+    lines += [f'qrt_stage_errors{{stage="{_label(r.stage)}"}} {r.errors}' for r in st.itertuples(index=False)]
+    lines += ["# HELP qrt_stage_tokens LLM tokens consumed per stage over the snapshot window.",
+              "# TYPE qrt_stage_tokens gauge"]
+    lines += [f'qrt_stage_tokens{{stage="{_label(r.stage)}"}} {r.tokens:.0f}'
+              for r in st.itertuples(index=False) if pd.notna(r.tokens)]
+    lines += ["# HELP qrt_stage_cache_hit_ratio Fraction of spans served from cache over the snapshot window.",
+              "# TYPE qrt_stage_cache_hit_ratio gauge"]
+    lines += [f'qrt_stage_cache_hit_ratio{{stage="{_label(r.stage)}"}} {r.cache_hit_rate:.4f}'
+              for r in st.itertuples(index=False) if pd.notna(r.cache_hit_rate)]
+    return "\n".join(lines) + "\n"
@@ -1,30 +1,72 @@
-import io
+import io, threading
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import risk_matrix, tracing
 
-def risk_heatmap(risks_df: pd.DataFrame):
-    # Crear matriz 5x5 prob vs impact con sumatorio de score
-    m = np.zeros((5,5))
-    if isinstance(risks_df, pd.DataFrame) and not risks_df.empty:
-        tmp = risks_df.copy()
-        for col in ["probability","impact","score"]:
-            if col not in tmp.columns: return None
-        for _, r in tmp.iterrows():
-            i = int(max(min(r["impact"],5),1))-1
-            p = int(max(min(r["probability"],5),1))-1
-            m[4-i, p] += float(r["score"])
+# --- Heatmap de riesgos: render cacheado por contenido de la matriz ---
+RENDER_CACHE_MAX_BYTES = 16 * 1024 * 1024
+_render_cache = OrderedDict()       # matrix_key -> bytes (LRU acotado por tamaño total)
+_render_cache_bytes = 0
+_render_lock = threading.Lock()
+
+def _cached_render(key: str, render):
+    global _render_cache_bytes
+    with _render_lock:
+        if key in _render_cache:
+            _render_cache.move_to_end(key)
+            return io.BytesIO(_render_cache[key])
+    data = render()
+    with _render_lock:
+        if key not in _render_cache:
+            _render_cache[key] = data; _render_cache_bytes += len(data)
+            while _render_cache_bytes > RENDER_CACHE_MAX_BYTES and len(_render_cache) > 1:
+                _, old = _render_cache.popitem(last=False); _render_cache_bytes -= len(old)
+    return io.BytesIO(data)
+
+def _heatmap_bytes(m: np.ndarray, title: str, fmt: str) -> bytes:
+    n = m.shape[0]
     fig, ax = plt.subplots(figsize=(5,4))
-    im = ax.imshow(m, aspect="auto")
-    ax.set_xticks(range(5)); ax.set_yticks(range(5))
-    ax.set_xticklabels([1,2,3,4,5]); ax.set_yticklabels([5,4,3,2,1])
+    ax.imshow(m, aspect="auto")
+    ax.set_xticks(range(n)); ax.set_yticks(range(n))
+    ax.set_xticklabels(range(1, n+1)); ax.set_yticklabels(range(n, 0, -1))
     ax.set_xlabel("Probability"); ax.set_ylabel("Impact")
-    ax.set_title("Risk Heatmap (score sum)")
-    for y in range(5):
-        for x in range(5):
+    ax.set_title(title)
+    for y in range(n):
+        for x in range(n):
             ax.text(x, y, f"{m[y,x]:.0f}", ha="center", va="center")
-    buf = io.BytesIO(); plt.tight_layout(); fig.savefig(buf, format="png"); plt.close(fig)
-    buf.seek(0); return buf
+    buf = io.BytesIO(); plt.tight_layout(); fig.savefig(buf, format=fmt); plt.close(fig)
+    return buf.getvalue()
+
+@tracing.traced("chart.risk_heatmap")
+def risk_heatmap(risks_df: pd.DataFrame, fmt: str = "png"):
+    # matriz 5x5 prob vs impact con sumatorio de score
+    if isinstance(risks_df, pd.DataFrame) and not risks_df.empty and \
+            not {"probability", "impact", "score"} <= set(risks_df.columns):
+        return None
+    m = risk_matrix.bin_matrix(risks_df)
+    title = "Risk Heatmap (score sum)"
+    return _cached_render(risk_matrix.matrix_key(m, title, fmt), lambda: _heatmap_bytes(m, title, fmt))
+
+def risk_heatmap_figure(risks_df: pd.DataFrame):
+    """Versión interactiva (Plotly) del heatmap; None si plotly no está instalado."""
+    try:
+        import plotly.graph_objects as go
+    except Exception:
+        return None
+    if isinstance(risks_df, pd.DataFrame) and not risks_df.empty and \
+            not {"probability", "impact", "score"} <= set(risks_df.columns):
+        return None
+    m, counts = risk_matrix.bin_matrix(risks_df), risk_matrix.bin_matrix(risks_df, value=None)
+    n = m.shape[0]
+    fig = go.Figure(go.Heatmap(z=m, x=list(range(1, n+1)), y=list(range(n, 0, -1)), customdata=counts,
+                               text=m.round(0), texttemplate="%{text}", colorscale="Viridis",
+                               hovertemplate="Probability %{x} · Impact %{y}<br>Score sum %{z:.0f}"
+                                             "<br>Risks %{customdata:.0f}<extra></extra>"))
+    fig.update_layout(title="Risk Heatmap (score sum)", xaxis_title="Probability", yaxis_title="Impact",
+                      yaxis_type="category", xaxis_type="category", height=420, margin=dict(t=50, b=40))
+    return fig
 
 def risk_bars(risks_df: pd.DataFrame):
     if not isinstance(risks_df, pd.DataFrame) or risks_df.empty:
@@ -36,6 +78,7 @@ def risk_bars(risks_df: pd.DataFrame):
     buf = io.BytesIO(); plt.tight_layout(); fig.savefig(buf, format="png"); plt.close(fig)
     buf.seek(0); return buf
 
+@tracing.traced("chart.pestel_radar")
 def pestel_radar(pestel_df: pd.DataFrame):
     if pestel_df is None or pestel_df.empty or "factor" not in pestel_df.columns:
         return None
@@ -53,3 +96,51 @@ def pestel_radar(pestel_df: pd.DataFrame):
     ax.set_title("PESTEL Radar (relative salience)")
     buf = io.BytesIO(); plt.tight_layout(); fig.savefig(buf, format="png"); plt.close(fig)
     buf.seek(0); return buf
+
+def mc_histogram(hist, summary: dict, title: str, xlabel: str, scale: float = 1.0):
+    # hist = (counts, edges) de simulation.monte_carlo; summary con P10/P50/P90
+    counts, edges = hist
+    if counts is None or np.sum(counts) == 0:
+        return None
+    fig, ax = plt.subplots(figsize=(5,3))
+    ax.bar(edges[:-1]*scale, counts, width=np.diff(edges)*scale, align="edge")
+    for p in ["P10","P50","P90"]:
+        v = summary.get(p)
+        if v is not None and np.isfinite(v):
+            ax.axvline(v*scale, linestyle="--", color="k", linewidth=1)
+            ax.text(v*scale, ax.get_ylim()[1]*0.95, p, ha="center", va="top", fontsize=8)
+    ax.set_title(title); ax.set_xlabel(xlabel); ax.set_ylabel("Paths")
+    buf = io.BytesIO(); plt.tight_layout(); fig.savefig(buf, format="png"); plt.close(fig)
+    buf.seek(0); return buf
+
+def sensitivity_heatmap(grid_df: pd.DataFrame, x: str, y: str, metric: str = "IRR", scale: float = 1.0):
+    # grid_df: corte de finance.sensitivity_grid con solo `x` e `y` libres
+    if not isinstance(grid_df, pd.DataFrame) or grid_df.empty:
+        return None
+    m = grid_df.pivot_table(index=y, columns=x, values=metric, aggfunc="mean").sort_index(ascending=False)
+    fig, ax = plt.subplots(figsize=(6,4))
+    im = ax.imshow(m.values*scale, aspect="auto")
+    ax.set_xticks(range(m.shape[1])); ax.set_yticks(range(m.shape[0]))
+    ax.set_xticklabels([f"{v:,.3g}" for v in m.columns]); ax.set_yticklabels([f"{v:,.3g}" for v in m.index])
+    ax.set_xlabel(x); ax.set_ylabel(y); ax.set_title(f"{metric} sensitivity ({y} × {x})")
+    for yy in range(m.shape[0]):
+        for xx in range(m.shape[1]):
+            ax.text(xx, yy, f"{m.values[yy,xx]*scale:.1f}", ha="center", va="center", fontsize=8)
+    fig.colorbar(im, ax=ax)
+    buf = io.BytesIO(); plt.tight_layout(); fig.savefig(buf, format="png"); plt.close(fig)
+    buf.seek(0); return buf
+
+def tornado_chart(tornado_df: pd.DataFrame, metric: str = "IRR", scale: float = 1.0):
+    # tornado_df: salida de finance.tornado
+    if not isinstance(tornado_df, pd.DataFrame) or tornado_df.empty:
+        return None
+    d = tornado_df.iloc[::-1]
+    base = d["Base"].iloc[0]*scale
+    lo = d[f"{metric}@Low"]*scale; hi = d[f"{metric}@High"]*scale
+    fig, ax = plt.subplots(figsize=(6,3))
+    ax.barh(d["Variable"], lo-base, left=base, label="Low")
+    ax.barh(d["Variable"], hi-base, left=base, label="High")
+    ax.axvline(base, color="k", linewidth=1)
+    ax.set_title(f"Tornado ({metric})"); ax.legend(loc="lower right", fontsize=8)
+    buf = io.BytesIO(); plt.tight_layout(); fig.savefig(buf, format="png"); plt.close(fig)
+    buf.seek(0); return buf